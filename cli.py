@@ -1,8 +1,60 @@
 #!/usr/bin/env python3
+import json
+import os
+import socket
+import sys
+
+
+def _forward(path, argv):
+    # Runs a command on the daemon listening on path (see serve) and copies
+    # its output. Returns its exit status, or None if no daemon is listening.
+    # Once the request is sent, the command is never run again here, as it
+    # may have been applied already: if the daemon goes away before
+    # replying, an error is printed and the status is 1.
+    conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        conn.connect(path)
+    except OSError:
+        conn.close()
+        return None
+    with conn, conn.makefile("rb") as reply:
+        request = {"argv": argv, "cwd": os.getcwd()}
+        try:
+            conn.sendall(json.dumps(request).encode() + b"\n")
+            line = reply.readline()
+        except OSError:
+            line = b""
+        if len(line) == 0:
+            print(
+                f"Error: the daemon at {path} went away before replying; "
+                + "the command may or may not have been applied.",
+                file=sys.stderr,
+            )
+            return 1
+        header = json.loads(line)
+        sys.stdout.buffer.write(reply.read(header["stdout"]))
+        sys.stderr.buffer.write(reply.read(header["stderr"]))
+    return header["status"]
+
+
+# Thin client mode: with SNPDB_SOCKET set, commands are sent to the daemon
+# listening there (see serve) before anything else is loaded. Without a
+# daemon, they run here as usual.
+if __name__ == "__main__" and os.environ.get("SNPDB_SOCKET"):
+    if sys.argv[1:2] != ["serve"]:
+        status = _forward(os.environ["SNPDB_SOCKET"], sys.argv[1:])
+        if status is not None:
+            sys.exit(status)
+
 import argparse
+import csv
+import io
 import snpdb
+import socketserver
 import time
+import traceback
 
+from bson import ObjectId
 from pprint import pprint
 from readers import *
 from writers import *
@@ -20,6 +72,15 @@ _SAMPLE_READERS = [
 _MAP_WRITERS = [Z125MapWriter, PlinkMapWriter]
 _SAMPLE_WRITERS = [Z125SampleWriter, PlinkSampleWriter]
 
+_WRITE_CONCERN_CHOICES = ["unacknowledged", "acknowledged", "journaled", "majority"]
+_READ_PREFERENCE_CHOICES = [
+    "primary",
+    "primaryPreferred",
+    "secondary",
+    "secondaryPreferred",
+    "nearest",
+]
+
 
 def import_map(filename, fmt, mapname, **kwargs):
     reader = _MAP_READERS[_FORMAT_CHOICES.index(fmt)](filename)
@@ -37,14 +98,137 @@ def import_samples(filename, fmt, mapname, idfilename=None, **kwargs):
     snpdb.import_samples(reader, mapname, id_map=id_map, **kwargs)
 
 
-def export_map(mapname, fmt, out_file_path):
+def export_map(mapname, fmt, out_file_path, **kwargs):
     writer = _MAP_WRITERS[_FORMAT_CHOICES.index(fmt)]
-    snpdb.export_map(mapname, writer, out_file_path)
+    snpdb.export_map(mapname, writer, out_file_path, **kwargs)
 
 
-def export_samples(samples, map, fmt, out_file_path):
+def export_samples(samples, map, fmt, out_file_path, keys=None, **kwargs):
     writer = _SAMPLE_WRITERS[_FORMAT_CHOICES.index(fmt)]
-    snpdb.export_samples(samples, map, writer, out_file_path)
+    snpdb.export_samples(samples, map, writer, out_file_path, keys=keys, **kwargs)
+
+
+def read_manifest(filename):
+    manifest = {}
+    with open(filename, "r", newline="") as f:
+        reader = csv.reader(f)
+        header = next(reader)
+        for row in reader:
+            metadata = {}
+            for key, value in zip(header[1:], row[1:]):
+                if value == "":
+                    continue
+                try:
+                    metadata[key] = int(value)
+                except ValueError:
+                    metadata[key] = value
+            manifest[row[0]] = metadata
+    return manifest
+
+
+def _file_filters(individual=None, name=None):
+    filters = {}
+    if individual is not None:
+        filters["individual_id"] = individual
+    if name is not None:
+        filters["filename"] = name
+    return filters
+
+
+def _add_paging_arguments(p, after_type=None):
+    p.add_argument("--limit", help="print at most LIMIT results", type=int)
+    p.add_argument(
+        "--skip", help="skip the first SKIP results (by internal id)", type=int
+    )
+    if after_type is not None:
+        p.add_argument(
+            "--after",
+            help="print only results whose internal id is greater than AFTER "
+            + "(use the last id printed to fetch the next page)",
+            type=after_type,
+        )
+    p.add_argument(
+        "--batch-size", help="number of results fetched per round trip", type=int
+    )
+    p.add_argument("--fields", help="print only these fields", nargs="+")
+
+
+def _run_forwarded(code, argv, cwd):
+    # Runs this script's code for a forwarded command, as if it had been
+    # started with argv in cwd. Returns (status, stdout bytes, stderr bytes).
+    out = io.TextIOWrapper(io.BytesIO(), write_through=True)
+    err = io.TextIOWrapper(io.BytesIO(), write_through=True)
+    saved = sys.argv, sys.stdin, sys.stdout, sys.stderr, os.getcwd()
+    sys.argv = [code.co_filename] + argv
+    sys.stdin, sys.stdout, sys.stderr = io.StringIO(), out, err
+    try:
+        os.chdir(cwd)
+        exec(code, {"__name__": "__main__", "__file__": code.co_filename})
+        status = 0
+    except SystemExit as e:
+        status = e.code if isinstance(e.code, int) else 0
+        if e.code is not None and not isinstance(e.code, int):
+            print(e.code, file=err)
+            status = 1
+    except Exception:
+        traceback.print_exc(file=err)
+        status = 1
+    finally:
+        sys.argv, sys.stdin, sys.stdout, sys.stderr, cwd = saved
+        os.chdir(cwd)
+    return status, out.detach().getvalue(), err.detach().getvalue()
+
+
+def serve(path, cache_ttl):
+    # Runs the commands forwarded by thin clients (see _forward), one at a
+    # time, in this process: the configuration, connection and caches are
+    # set up once instead of on every call.
+    with open(__file__, "r") as f:
+        code = compile(f.read(), os.path.abspath(__file__), "exec")
+    os.environ.pop("SNPDB_SOCKET", None)
+    snpdb.connect(map_cache_ttl=cache_ttl)
+
+    class Handler(socketserver.StreamRequestHandler):
+        def handle(self):
+            request = json.loads(self.rfile.readline())
+            if request["argv"][:1] == ["serve"]:
+                status, out, err = 1, b"", b"Already serving.\n"
+            else:
+                status, out, err = _run_forwarded(
+                    code, request["argv"], request["cwd"]
+                )
+            header = {"status": status, "stdout": len(out), "stderr": len(err)}
+            self.wfile.write(json.dumps(header).encode() + b"\n" + out + err)
+
+    if os.path.exists(path):
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(path)
+        except OSError:
+            os.remove(path)  # left behind by a daemon that is gone
+        else:
+            raise Exception(f"A daemon is already listening on {path}.")
+        finally:
+            probe.close()
+    try:
+        with socketserver.UnixStreamServer(path, Handler) as server:
+            print(f"Serving on {path}.", flush=True)
+            server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def _paging_kwargs(args):
+    return {
+        "limit": args.limit,
+        "skip": args.skip,
+        "after": getattr(args, "after", None),
+        "batch_size": args.batch_size,
+        "projection": args.fields,
+    }
 
 
 if __name__ == "__main__":
@@ -70,6 +254,11 @@ if __name__ == "__main__":
         + "snps when available (may ask user to decide which)",
         action="store_true",
     )
+    p.add_argument(
+        "--write-concern",
+        help="write concern of the import (default: from the configuration)",
+        choices=_WRITE_CONCERN_CHOICES,
+    )
 
     # import-sample
     p = subparsers.add_parser("import-samples", help="import samples from file")
@@ -87,6 +276,11 @@ if __name__ == "__main__":
         + "first column and individual id onthe "
         + "second",
     )
+    p.add_argument(
+        "--write-concern",
+        help="write concern of the import (default: from the configuration)",
+        choices=_WRITE_CONCERN_CHOICES,
+    )
 
     # find-snps
     p = subparsers.add_parser("find-snps", help="search snps in the database")
@@ -114,6 +308,7 @@ if __name__ == "__main__":
         type=int,
     )
     p.add_argument("--map", help="match snps that belong to MAP")
+    _add_paging_arguments(p, after_type=int)
 
     # find-maps
     p = subparsers.add_parser("find-maps", help="search maps in the database")
@@ -125,6 +320,7 @@ if __name__ == "__main__":
     p.add_argument(
         "--max-size", help="match only maps of size " + "at most MAX_SIZE", type=int
     )
+    _add_paging_arguments(p, after_type=str)
 
     # find-individuals
     p = subparsers.add_parser(
@@ -142,11 +338,13 @@ if __name__ == "__main__":
         "--map",
         help="match only individuals which have a " + "sample with this specific map",
     )
+    _add_paging_arguments(p, after_type=int)
 
     # find-samples
     p = subparsers.add_parser("find-samples", help="search samples in the database")
     p.add_argument("--id", help="match sample id within map")
     p.add_argument("--map", help="match map the sample belongs to")
+    _add_paging_arguments(p)
 
     # get-snp-genotype
     p = subparsers.add_parser(
@@ -155,14 +353,56 @@ if __name__ == "__main__":
     p.add_argument("map", help="map to which the sample belongs")
     p.add_argument("sample", help="id of the sample")
     p.add_argument("snp", help="internal id of the SNP", type=int)
+    p.add_argument("--keys", help="fetch only these genotype keys (e.g. gc)", nargs="+")
 
     # put-file
     p = subparsers.add_parser("put-file", help="upload file to the database")
-    p.add_argument("file", help="path of file to upload", nargs="+")
+    p.add_argument(
+        "file",
+        help="path of file to upload (directories are uploaded recursively)",
+        nargs="+",
+    )
     p.add_argument(
         "--individual",
         help="internal id of an individual" + " to be associated with the file",
+        type=int,
     )
+    p.add_argument("--type", help="type of the files (FastQ, Image, etc)")
+    p.add_argument("--description", help="description of the files")
+    p.add_argument(
+        "--manifest",
+        help="CSV file with a header; first column holds file names, the "
+        + "others metadata for each file (e.g. individual_id, type)",
+    )
+    p.add_argument(
+        "--workers",
+        help="number of files uploaded in parallel",
+        type=int,
+        default=4,
+    )
+    p.add_argument(
+        "--dedup",
+        help="store contents already in the database only once",
+        action="store_true",
+    )
+    p.add_argument(
+        "--codec",
+        help="compress the files in the database with this codec",
+        choices=["gzip", "zstd"],
+    )
+    p.add_argument(
+        "--fastq-index",
+        help="index FASTQ files, storing the offset of one of every "
+        + "FASTQ_INDEX reads",
+        type=int,
+    )
+    p.add_argument(
+        "--analyze",
+        help="compute statistics about FASTQ, VCF and image files while "
+        + "uploading them",
+        action="store_true",
+    )
+    p.add_argument("-q", "--quiet", help="omit all output", action="store_true")
 
     # find-files
     p = subparsers.add_parser("find-files", help="search files in the database")
@@ -170,8 +410,10 @@ if __name__ == "__main__":
         "--individual",
         help="match only files associated with "
         + "individual whose internal id is INDIVIDUAL",
+        type=int,
     )
     p.add_argument("--name", help="match file name exactly")
+    _add_paging_arguments(p)
 
     # get-files
     p = subparsers.add_parser("get-files", help="download files from the database")
@@ -179,14 +421,67 @@ if __name__ == "__main__":
         "--individual",
         help="download only files associated "
         + "with individual whose internal id is INDIVIDUAL",
+        type=int,
     )
     p.add_argument("--name", help="download only files with the specified NAME")
+    p.add_argument("--dir", help="directory to download to", default=".")
+    p.add_argument(
+        "--workers",
+        help="number of files downloaded in parallel",
+        type=int,
+        default=4,
+    )
+    p.add_argument(
+        "--on-collision",
+        help="what to do when a file with the same name already exists",
+        choices=["overwrite", "skip", "rename"],
+        default="overwrite",
+    )
+
+    # read-file
+    p = subparsers.add_parser(
+        "read-file",
+        help="print a byte range of a stored file without downloading it all",
+    )
+    p.add_argument("id", help="id of the file (as shown by find-files)")
+    p.add_argument("offset", help="position of the first byte to read", type=int)
+    p.add_argument("length", help="number of bytes to read", type=int)
+    p.add_argument("--out", help="write to OUT instead of standard output")
+
+    # fastq-stats
+    p = subparsers.add_parser(
+        "fastq-stats", help="print read statistics of an indexed FASTQ file"
+    )
+    p.add_argument("id", help="id of the file (as shown by find-files)")
+
+    # get-reads
+    p = subparsers.add_parser(
+        "get-reads", help="print reads from an indexed FASTQ file"
+    )
+    p.add_argument("id", help="id of the file (as shown by find-files)")
+    p.add_argument("start", help="number of the first read, from 0", type=int)
+    p.add_argument("--count", help="number of reads to print", type=int, default=1)
+
+    # delete-files
+    p = subparsers.add_parser("delete-files", help="delete files from the database")
+    p.add_argument(
+        "--individual",
+        help="delete only files associated "
+        + "with individual whose internal id is INDIVIDUAL",
+        type=int,
+    )
+    p.add_argument("--name", help="delete only files with the specified NAME")
 
     # export-map
     p = subparsers.add_parser("export-map", help="export map from database to file")
     p.add_argument("format", help="format of the output file", choices=["0125", "pl"])
     p.add_argument("map", help="name of the map to export")
     p.add_argument("outfile", help="path of the file to export to")
+    p.add_argument(
+        "--read-preference",
+        help="replica set members to read from (default: from the configuration)",
+        choices=_READ_PREFERENCE_CHOICES,
+    )
 
     # export-samples
     p = subparsers.add_parser(
@@ -202,6 +497,12 @@ if __name__ == "__main__":
         + "within map",
         nargs="*",
     )
+    p.add_argument("--keys", help="export only these genotype keys (e.g. g)", nargs="+")
+    p.add_argument(
+        "--read-preference",
+        help="replica set members to read from (default: from the configuration)",
+        choices=_READ_PREFERENCE_CHOICES,
+    )
 
     # summarize
     p = subparsers.add_parser(
@@ -220,6 +521,97 @@ if __name__ == "__main__":
         "--map",
         help="match only individuals which have a " + "sample with this specific map",
     )
+    p.add_argument(
+        "--read-preference",
+        help="replica set members to read from (default: from the configuration)",
+        choices=_READ_PREFERENCE_CHOICES,
+    )
+
+    # delete-individuals
+    p = subparsers.add_parser(
+        "delete-individuals",
+        help="delete individuals and all their samples from the database",
+    )
+    p.add_argument(
+        "--name",
+        help="match at least one of the individuals' " + "names (tatoos) exactly",
+    )
+    p.add_argument(
+        "--sample",
+        help="match only individuals which have a " + "sample with this specific id",
+    )
+    p.add_argument(
+        "--map",
+        help="match only individuals which have a " + "sample with this specific map",
+    )
+    p.add_argument(
+        "--dry-run",
+        help="only count what would be deleted",
+        action="store_true",
+    )
+    p.add_argument("-q", "--quiet", help="omit all output", action="store_true")
+
+    # delete-map
+    p = subparsers.add_parser(
+        "delete-map", help="delete a map and all samples and snps that depend on it"
+    )
+    p.add_argument("mapname", help="name of the map to delete")
+    p.add_argument("-q", "--quiet", help="omit all output", action="store_true")
+
+    # gc
+    p = subparsers.add_parser(
+        "gc", help="find and delete orphaned samples, snp blocks and snps"
+    )
+    p.add_argument(
+        "--report-only", help="only count orphans, delete nothing", action="store_true"
+    )
+    p.add_argument(
+        "--batch-size",
+        help="number of documents examined per batch",
+        type=int,
+        default=1000,
+    )
+    p.add_argument(
+        "--throttle", help="seconds to sleep between batches", type=float, default=0.0
+    )
+    p.add_argument(
+        "--min-age",
+        help="skip samples and blocks created less than MIN_AGE seconds ago "
+        + "(default: the configuration's GC_MIN_AGE)",
+        type=float,
+    )
+    p.add_argument(
+        "--every",
+        help="keep running, starting a new pass every EVERY seconds",
+        type=float,
+    )
+    p.add_argument("-q", "--quiet", help="omit all output", action="store_true")
+
+    # rebuild-summaries
+    p = subparsers.add_parser(
+        "rebuild-summaries",
+        help="recompute the materialized summaries of all individuals",
+    )
+    p.add_argument("-q", "--quiet", help="omit all output", action="store_true")
+
+    # serve
+    p = subparsers.add_parser(
+        "serve",
+        help="run commands sent by other calls of this script (those run "
+        + "with SNPDB_SOCKET set to the socket) in a single long-running "
+        + "process, keeping its connection and caches",
+    )
+    p.add_argument(
+        "--socket",
+        help="path of the Unix socket to listen on (default: snpdb.sock)",
+        default=os.environ.get("SNPDB_SOCKET", "snpdb.sock"),
+    )
+    p.add_argument(
+        "--cache-ttl",
+        help="seconds map metadata is cached for (default: 60)",
+        type=float,
+        default=60.0,
+    )
 
     args = parser.parse_args()
     if args.subcommand == "import-map":
@@ -232,6 +624,7 @@ if __name__ == "__main__":
             force_create_new=args.force_create_new,
             force_use_existing=args.force_use_existing,
             report=report,
+            write_concern=args.write_concern,
         )
         print(f"Done in {time.time() - start:.3f} s.")
     elif args.subcommand == "import-samples":
@@ -243,10 +636,11 @@ if __name__ == "__main__":
             args.mapname,
             idfilename=args.idfile,
             report=report,
+            write_concern=args.write_concern,
         )
         print(f"Done in {time.time() - start:.3f} s.")
     elif args.subcommand == "find-snps":
-        for snp in snpdb.find_snp(
+        for snp in snpdb.iter_snp(
             args.name,
             args.min_chr,
             args.max_chr,
@@ -255,36 +649,149 @@ if __name__ == "__main__":
             args.map,
             args.id,
             args.chr,
+            **_paging_kwargs(args),
         ):
-            print(snp)
+            print(snp, flush=True)
     elif args.subcommand == "find-maps":
-        for map in snpdb.find_maps(
-            args.name, args.min_size, args.max_size, args.format
+        for map in snpdb.iter_maps(
+            args.name, args.min_size, args.max_size, args.format, **_paging_kwargs(args)
         ):
-            print(map)
+            print(map, flush=True)
     elif args.subcommand == "find-individuals":
-        for ind in snpdb.find_individuals(None, args.name, args.map, args.sample):
-            print(ind)
+        for ind in snpdb.iter_individuals(
+            None, args.name, args.map, args.sample, **_paging_kwargs(args)
+        ):
+            print(ind, flush=True)
     elif args.subcommand == "find-samples":
-        for sample in snpdb.find_sample(args.id, args.map):
-            print(sample)
+        for sample in snpdb.iter_sample(args.id, args.map, **_paging_kwargs(args)):
+            print(sample, flush=True)
     elif args.subcommand == "get-snp-genotype":
-        print(snpdb.find_snp_of_sample(args.map, args.sample, args.snp))
+        print(snpdb.find_snp_of_sample(args.map, args.sample, args.snp, args.keys))
     elif args.subcommand == "put-file":
-        for fname in args.file:
-            with open(fname, "rb") as f:
-                snpdb.insert_file(f, args.individual)
+        metadata = {}
+        if args.individual is not None:
+            metadata[snpdb._config["FILES_INDIVIDUAL_ATTR"]] = args.individual
+        if args.type is not None:
+            metadata[snpdb._config["FILES_TYPE"]] = args.type
+        if args.description is not None:
+            metadata[snpdb._config["FILES_DESCRIPTION"]] = args.description
+        manifest = None
+        if args.manifest is not None:
+            manifest = read_manifest(args.manifest)
+        snpdb.insert_files(
+            args.file,
+            manifest=manifest,
+            workers=args.workers,
+            report=not args.quiet,
+            dedup=args.dedup,
+            codec=args.codec,
+            fastq_index=args.fastq_index,
+            analyze=args.analyze,
+            **metadata,
+        )
     elif args.subcommand == "find-files":
-        for file in snpdb.list_files(args.individual, args.name):
-            print(file)
+        for file in snpdb.iter_files(
+            **_file_filters(args.individual, args.name), **_paging_kwargs(args)
+        ):
+            print(file, flush=True)
     elif args.subcommand == "get-files":
-        snpdb.get_files(snpdb.list_files(args.individual, args.name))
+        snpdb.get_files(
+            snpdb.iter_files(
+                **_file_filters(args.individual, args.name), projection=["_id"]
+            ),
+            directory=args.dir,
+            workers=args.workers,
+            on_collision=args.on_collision,
+        )
+    elif args.subcommand == "read-file":
+        data = snpdb.read_file_range(ObjectId(args.id), args.offset, args.length)
+        if args.out is None:
+            sys.stdout.buffer.write(data)
+        else:
+            with open(args.out, "wb") as f:
+                f.write(data)
+    elif args.subcommand == "fastq-stats":
+        index = snpdb.get_fastq_index(ObjectId(args.id))
+        if index is None:
+            print("File has no FASTQ index.")
+        else:
+            del index["offsets"]
+            pprint(index)
+    elif args.subcommand == "get-reads":
+        for record in snpdb.read_fastq_records(
+            ObjectId(args.id), args.start, args.count
+        ):
+            print(
+                "@" + record["name"],
+                record["sequence"],
+                "+",
+                record["quality"],
+                sep="\n",
+                flush=True,
+            )
+    elif args.subcommand == "delete-files":
+        if args.individual is None and args.name is None:
+            print("Specify --individual and/or --name.")
+        else:
+            snpdb.delete_files(
+                snpdb.list_files(**_file_filters(args.individual, args.name))
+            )
     elif args.subcommand == "export-map":
-        export_map(args.map, args.format, args.outfile)
+        export_map(
+            args.map, args.format, args.outfile, read_preference=args.read_preference
+        )
     elif args.subcommand == "export-samples":
-        export_samples(args.sample, args.map, args.format, args.outfile)
+        export_samples(
+            args.sample,
+            args.map,
+            args.format,
+            args.outfile,
+            args.keys,
+            read_preference=args.read_preference,
+        )
     elif args.subcommand == "summarize":
-        for ind in snpdb.find_individuals(None, args.name, args.map, args.sample):
-            pprint(snpdb.summarize(ind))
+        individuals = snpdb.find_individuals(None, args.name, args.map, args.sample)
+        for summary in snpdb.summarize(
+            individuals, read_preference=args.read_preference
+        ):
+            pprint(summary)
+    elif args.subcommand == "delete-individuals":
+        start = time.time()
+        result = snpdb.delete_individuals(
+            None,
+            args.name,
+            args.map,
+            args.sample,
+            dry_run=args.dry_run,
+            report=not args.quiet,
+        )
+        if len(result) == 0:
+            print("No individuals matched.")
+        print(f"Done in {time.time() - start:.3f} s.")
+    elif args.subcommand == "delete-map":
+        start = time.time()
+        snpdb.delete_map(args.mapname, report=not args.quiet)
+        print(f"Done in {time.time() - start:.3f} s.")
+    elif args.subcommand == "gc":
+        while True:
+            start = time.time()
+            snpdb.collect_garbage(
+                args.batch_size,
+                args.throttle,
+                args.report_only,
+                report=not args.quiet,
+                min_age=args.min_age,
+            )
+            if not args.quiet:
+                print(f"Done in {time.time() - start:.3f} s.")
+            if args.every is None:
+                break
+            time.sleep(max(0.0, args.every - (time.time() - start)))
+    elif args.subcommand == "rebuild-summaries":
+        start = time.time()
+        snpdb.rebuild_summaries(report=not args.quiet)
+        print(f"Done in {time.time() - start:.3f} s.")
+    elif args.subcommand == "serve":
+        serve(args.socket, args.cache_ttl)
     elif args.subcommand is None:
         print("Subcommand required. Use -h for help.")
@@ -1,6 +1,8 @@
 config = {
 	"HOST": "localhost",
 	"DB_NAME": "snpdb",
+	"WRITE_CONCERN": "acknowledged",
+	"READ_PREFERENCE": "primary",
 
 	"SNPS_COLL": "snps",
 	"SNPS_NAME_ATTR": "i",
@@ -35,12 +37,50 @@ config = {
 	"SNPBLOCKS_GENOTYPE": "g",
 	"SNPBLOCKS_SNPS_PER_BLOCK": 10000,
 
+	"SUMMARIES_COLL": "individual_summaries",
+	"SUMMARIES_ENABLED": false,
+
+	"MAINTENANCE_COLL": "maintenance_log",
+	"GC_MIN_AGE": 86400,
+
+	"FASTQ_INDEXES_COLL": "fastq_indexes",
+
 	"COUNTERS_COLL": "counters",
 	"COUNTERS_SEQ_VALUE_ATTR": "next",
 
 	"FILES_FILENAME": "filename",
 	"FILES_INDIVIDUAL_ATTR": "individual_id",
 	"FILES_TYPE": "type",
-	"FILES_DESCRIPTION": "description"
+	"FILES_DESCRIPTION": "description",
+	"FILES_HASH_ATTR": "sha256",
+	"FILES_CONTENT_ATTR": "content_id",
+	"FILES_REFS_ATTR": "refs",
+	"FILES_DELETED_ATTR": "deleted",
+	"FILES_CODEC_ATTR": "codec",
+	"FILES_SIZE_ATTR": "size",
+	"FILES_FRAMES_ATTR": "frames",
+	"FILES_FRAME_SIZE": 1048576,
+	"FILES_STATS_ATTR": "stats",
+
+	"INDEXES": [
+		{"collection": "SNPS_COLL", "keys": ["SNPS_NAME_ATTR"], "defer": true},
+		{"collection": "SNPS_COLL", "keys": ["SNPS_CHROMOSOME_ATTR", "SNPS_POSITION_ATTR"]},
+		{"collection": "SNPS_COLL", "keys": ["SNPS_MAPS_ATTR"], "defer": true},
+		{"collection": "INDIVIDUALS_COLL", "keys": ["INDIVIDUALS_ID_LIST_ATTR"]},
+		{"collection": "INDIVIDUALS_COLL", "keys": ["INDIVIDUALS_SAMPLE_LIST_ATTR.SAMPLES_MAP_ATTR"], "defer": true},
+		{"collection": "INDIVIDUALS_COLL", "keys": ["INDIVIDUALS_SAMPLE_LIST_ATTR.SAMPLES_ID_ATTR"], "defer": true},
+		{"collection": "MAPSNPS_COLL", "keys": ["MAPSNPS_MAP_ATTR", "MAPSNPS_IDX_ATTR"], "unique": true},
+		{"collection": "SAMPLES_COLL", "keys": ["SAMPLES_MAP_ATTR", "SAMPLES_ID_ATTR"], "unique": true, "defer": true},
+		{"collection": "SAMPLES_COLL", "keys": ["SAMPLES_ID_ATTR"], "defer": true},
+		{"collection": "SNPBLOCKS_COLL", "keys": ["SNPBLOCKS_MAP_ATTR", "SNPBLOCKS_SAMPLE_ATTR", "SNPBLOCKS_BLOCK_NUMBER"], "defer": true},
+		{"collection": "SUMMARIES_COLL", "keys": ["maps.map"]},
+		{"collection": "SUMMARIES_COLL", "keys": ["samples.map", "samples.id"]},
+		{"collection": "SUMMARIES_COLL", "keys": ["files._id"]},
+		{"collection": "fs.files", "keys": ["FILES_FILENAME", "uploadDate"]},
+		{"collection": "fs.files", "keys": ["metadata.FILES_INDIVIDUAL_ATTR", "metadata.FILES_TYPE"]},
+		{"collection": "fs.files", "keys": ["metadata.FILES_TYPE"]},
+		{"collection": "fs.files", "keys": ["metadata.FILES_DESCRIPTION"]},
+		{"collection": "fs.files", "keys": ["metadata.FILES_HASH_ATTR"]}
+	]
 }
 
@@ -1,4 +1,3 @@
-import importlib
 import os
 import readers
 import snpdb
@@ -241,7 +240,8 @@ def reset_db(compression_method: str) -> None:
         stderr=subprocess.STDOUT,
         check=True,
     )
-    importlib.reload(snpdb)
+    # Start over with fresh handles to the recreated database.
+    snpdb.connect()
 
 
 def generate_random_file(
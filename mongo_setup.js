@@ -13,35 +13,46 @@ function keyValueObject(key1, value1, ...args) {
 	return obj;
 }
 
+/* Resolves a name used in the INDEXES spec: each dot-separated part that is
+a configuration key is replaced by its value. */
+function resolve(name) {
+	return name.split(".").map(part => part in config ? config[part] : part).join(".");
+}
+
 
 db = connect(config.HOST + "/" + config.DB_NAME);
 db.dropDatabase()
 
 db.createCollection(config.SNPS_COLL);
-db[config.SNPS_COLL].createIndex(keyValueObject(config.SNPS_NAME_ATTR, 1));
-db[config.SNPS_COLL].createIndex(keyValueObject(config.SNPS_CHROMOSOME_ATTR, 1, config.SNPS_POSITION_ATTR, 1));
-db[config.SNPS_COLL].createIndex(keyValueObject(config.SNPS_MAPS_ATTR, 1));
 
 db.createCollection(config.INDIVIDUALS_COLL);
-db[config.INDIVIDUALS_COLL].createIndex(keyValueObject(config.INDIVIDUALS_ID_LIST_ATTR, 1));
-db[config.INDIVIDUALS_COLL].createIndex(keyValueObject(config.INDIVIDUALS_SAMPLE_LIST_ATTR + "." + config.SAMPLES_MAP_ATTR, 1));
-db[config.INDIVIDUALS_COLL].createIndex(keyValueObject(config.INDIVIDUALS_SAMPLE_LIST_ATTR + "." + config.SAMPLES_ID_ATTR, 1));
 
 db.createCollection(config.MAPS_COLL);
 
 db.createCollection(config.MAPSNPS_COLL);
-db[config.MAPSNPS_COLL].createIndex(keyValueObject(config.MAPSNPS_MAP_ATTR, 1, config.MAPSNPS_IDX_ATTR, 1), unique = true)
 
 db.createCollection(config.SAMPLES_COLL)
-db[config.SAMPLES_COLL].createIndex(keyValueObject(config.SAMPLES_MAP_ATTR, 1, config.SAMPLES_ID_ATTR, 1), unique = true)
-db[config.SAMPLES_COLL].createIndex(keyValueObject(config.SAMPLES_ID_ATTR, 1))
 
 db.createCollection(config.SNPBLOCKS_COLL);
-db[config.SNPBLOCKS_COLL].createIndex(keyValueObject(config.SNPBLOCKS_MAP_ATTR, 1, config.SNPBLOCKS_SAMPLE_ATTR, 1, config.SNPBLOCKS_BLOCK_NUMBER, 1));
+
+/* Materialized per-individual summaries (see SUMMARIES_ENABLED). */
+db.createCollection(config.SUMMARIES_COLL);
+
+/* Results of maintenance jobs (see collect_garbage). */
+db.createCollection(config.MAINTENANCE_COLL);
+
+/* Record offsets and read statistics of FASTQ files (see insert_file). */
+db.createCollection(config.FASTQ_INDEXES_COLL);
 
 /* Collection for generating sequential ids. */
 db.createCollection(config.COUNTERS_COLL);
 db[config.COUNTERS_COLL].insert(keyValueObject("_id", config.SNPS_COLL, config.COUNTERS_SEQ_VALUE_ATTR, NumberInt(0)));
 db[config.COUNTERS_COLL].insert(keyValueObject("_id", config.INDIVIDUALS_COLL, config.COUNTERS_SEQ_VALUE_ATTR, NumberInt(0)));
 
-db.fs.data.createIndex(keyValueObject(config.FILES_INDIVIDUAL_ATTR, 1))
+/* Indexes, from the spec shared with snpdb.create_indexes (see INDEXES). */
+for (const index of config.INDEXES) {
+	keys = {};
+	for (const key of index.keys)
+		keys[resolve(key)] = 1;
+	db.getCollection(resolve(index.collection)).createIndex(keys, {unique: index.unique || false});
+}
@@ -0,0 +1,15 @@
+
+/* Sets up the database as mongo_setup.js does, then shards the SNP blocks
+collection. Run it on a mongos of the cluster (HOST on config.js), e.g.
+mongo mongo_shard_setup.js */
+load("mongo_setup.js");
+
+/* Blocks are sharded on (map, hashed sample, block number). Hashing the
+sample spreads the samples of a map, which are imported one after another,
+across all chunks, while all the blocks of a sample stay together in one
+chunk, so reading a sample targets a single shard. */
+sh.enableSharding(config.DB_NAME);
+sh.shardCollection(
+	config.DB_NAME + "." + config.SNPBLOCKS_COLL,
+	keyValueObject(config.SNPBLOCKS_MAP_ATTR, 1, config.SNPBLOCKS_SAMPLE_ATTR, "hashed", config.SNPBLOCKS_BLOCK_NUMBER, 1)
+);
@@ -1,15 +1,40 @@
 """SNP database manipulation tools.
 
 This module contains methods to import to and query the SNP database.
-When it's loaded, reads database configuration file with a call to read_config.
-It expects it to be named "config.js" and exist in the working directory.
+They are methods of SnpDB, which handles one database, and are also
+available as module-level functions working on a default instance.
+Importing the module has no side effects: the database configuration file
+is read (see read_config) and the connection is opened the first time the
+database is used, or by an explicit call to connect. By default, the
+configuration file is expected to be named "config.js" and exist in the
+working directory.
 """
 
 from abc import ABC, abstractmethod
-from pymongo import MongoClient, UpdateOne, ASCENDING
+from concurrent.futures import ThreadPoolExecutor
+from pymongo import MongoClient, UpdateOne, ASCENDING, IndexModel, WriteConcern
+from pymongo import ReadPreference, ReturnDocument
+from pymongo.errors import OperationFailure
+from pymongo.results import DeleteResult
+from bson import ObjectId
+from bson.max_key import MaxKey
+from bson.min_key import MinKey
+from collections import Counter
+from contextlib import contextmanager
 from gridfs import GridFS
+import bisect
+import functools
+import gzip
+import hashlib
+import io
 import json
+import numpy as np
 import os
+import queue
+import struct
+import threading
+import time
+from datetime import datetime, timedelta, timezone
 from typing import Union
 
 
@@ -239,958 +264,330 @@ class SampleWriter(ABC):
         pass
 
 
-def read_config(path="config.js"):
-    """Load configuration file and return its contents.
-
-    The configuration file a JSON file, except that it begins with an
-    assignment: config = {JSON...}
-    This is so it can also be used by mongo_setup.js, which runs on the
-    MongoDB shell.
-    Returns a dict with the contents of the JSON.
+class StoredFileReader(io.RawIOBase):
+    """Seekable, read-only file-like view of a file stored in the database.
 
-    Attributes
-    ----------
-    path="config.js"    Path to the configuration file.
+    Each read fetches only the GridFS chunks covering the requested bytes
+    (see read_file_range), so tools can stream or seek through a stored file
+    without downloading it. Wrap it in an io.BufferedReader (as open_file
+    does) to avoid a round trip per small read.
     """
-    s = ""
-    with open(path, "r") as f:
-        jsonBegin = False
-        for line in f:
-            if jsonBegin:
-                s += line
-            else:
-                open_bracket = line.find("{")
-                if open_bracket != -1:
-                    jsonBegin = True
-                    s += line[open_bracket:]
-    return json.loads(s)
-
 
-# Initialization.
-_config = read_config()
-_client = MongoClient(_config["HOST"], w=1)
-_db = _client[_config["DB_NAME"]]
-_SNPS = _db[_config["SNPS_COLL"]]
-_MAPS = _db[_config["MAPS_COLL"]]
-_INDS = _db[_config["INDIVIDUALS_COLL"]]
-_SNPBLOCKS = _db[_config["SNPBLOCKS_COLL"]]
-_COUNTERS = _db[_config["COUNTERS_COLL"]]
-_SAMPLES = _db[_config["SAMPLES_COLL"]]
-_MAPSNPS = _db[_config["MAPSNPS_COLL"]]
-_GFS = GridFS(_db)
-
-
-def delete_individuals(id=None, tatoo=None, sample_map=None, sample_id=None) -> list:
-    """Search and delete all data from individuals in the database.
-
-    Returns a list with the status of the delete operations.
-
-    Parameters
-    ----------
-    id=None             Match only the individual with given internal id.
-    tatoo=None          Match only individuals which contain tatoo among
-                        their alternate IDs.
-    sample_map=None     Match only individuals that have data on the specified
-                        map.
-    sample_id=None      Match only individuals that have the specified sample
-                        id under some map.
-    """
-    result: list = []
-    individuals: list = find_individuals(id, tatoo, sample_map, sample_id)
-    samples = [
-        (s[_config["SAMPLES_MAP_ATTR"]], s[_config["SAMPLES_ID_ATTR"]])
-        for ss in [ind[_config["INDIVIDUALS_SAMPLE_LIST_ATTR"]] for ind in individuals]
-        for s in ss
-    ]
-    if len(individuals):
-        query_snpblocks: dict = {
-            "$or": [
-                {
-                    _config["SNPBLOCKS_MAP_ATTR"]: map_name,
-                    _config["SNPBLOCKS_SAMPLE_ATTR"]: sample_id,
-                }
-                for map_name, sample_id in samples
-            ]
-        }
-        query_samples: dict = {
-            "$or": [
-                {
-                    _config["SAMPLES_MAP_ATTR"]: map_name,
-                    _config["SAMPLES_ID_ATTR"]: sample_id,
-                }
-                for map_name, sample_id in samples
-            ]
-        }
-        query_individuals: dict = {"$or": [{"_id": ind["_id"]} for ind in individuals]}
-        result.append(_SNPBLOCKS.delete_many(query_snpblocks))
-        result.append(_SAMPLES.delete_many(query_samples))
-        result.append(_INDS.delete_many(query_individuals))
-    return result
-
-
-def find_snp(
-    id=None,
-    min_chrom=None,
-    max_chrom=None,
-    min_pos=None,
-    max_pos=None,
-    map=None,
-    iid=None,
-    chr=None,
-):
-    """Search SNPs in the database.
-
-    Returns a list of dicts, each representing a SNP.
+    def __init__(self, file_id, db=None):
+        """Open the stored file with the given id.
 
-    Parameters
-    ----------
-    id=None          Match only SNPs with given name.
-    min_chrom=None   Match only SNPs with a chromosome that compares greater
-                     or equal to the one given.
-    max_chrom=None   Match only SNPs with a chromosome that compares lesser
-                     or equal to the one given.
-    min_pos=None     Match only SNPs with a position value that compares
-                     greater or equal than the one given.
-    max_pos=None     Match only SNPs with a position value that compares
-                     smaller or equal than the one given.
-    map=None         Match only SNPs that are contained within the map given.
-    iid=None         Match only the SNP with the given internal numeric id.
-    chr=None         Match only the SNPs with the given chromosome.
-    """
-    chrom = _config["SNPS_CHROMOSOME_ATTR"]
-    pos = _config["SNPS_POSITION_ATTR"]
-    name = _config["SNPS_NAME_ATTR"]
-    mp = _config["SNPS_MAPS_ATTR"]
-    query, chrom_query, pos_query = {}, {}, {}
-
-    if min_chrom is not None:
-        chrom_query.update({"$gte": min_chrom})
-    if max_chrom is not None:
-        chrom_query.update({"$lte": max_chrom})
-    if chr is not None:
-        try:
-            chrom_query.update({"$eq": int(chr)})
-        except ValueError:
-            chrom_query.update({"$eq": chr})
-    if min_pos is not None:
-        pos_query.update({"$gte": min_pos})
-    if max_pos is not None:
-        pos_query.update({"$lte": max_pos})
-
-    if id is not None:
-        query.update({name: id})
-    if map is not None:
-        query.update({mp: map})
-    if iid is not None:
-        query.update({"_id": iid})
-    if len(chrom_query) > 0:
-        query.update({chrom: chrom_query})
-    if len(pos_query) > 0:
-        query.update({pos: pos_query})
-    return list(_SNPS.find(query))
-
-
-def find_maps(id=None, min_size=None, max_size=None, format=None):
-    """Search maps in the database.
-
-    Returns a list of dicts, each representing a map.
+        Attributes
+        ----------
+        file_id    The "_id" of the file, as returned by list_files.
+        db=None    SnpDB instance holding the file. Defaults to the default
+                   instance (see default_db).
+        """
+        self._snpdb = db if db is not None else default_db()
+        self._doc = self._snpdb._file_contents(file_id)
+        self._pos = 0
 
-    Parameters
-    ----------
-    id=None          Match only maps with given name.
-    min_size=None    Match only maps with size at least min_size.
-    max_size=None    Match only maps with size at most map_size.
-    format=None      Match only maps with the specified format identifier.
+    def __len__(self):
+        return self._snpdb._content_length(self._doc)
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._pos
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self._pos
+        elif whence == io.SEEK_END:
+            offset += self._snpdb._content_length(self._doc)
+        if offset < 0:
+            raise ValueError("Negative seek position.")
+        self._pos = offset
+        return self._pos
+
+    def readinto(self, b):
+        data = self._snpdb._read_contents(self._doc, self._pos, len(b))
+        b[: len(data)] = data
+        self._pos += len(data)
+        return len(data)
+
+
+class FileAnalyzer(ABC):
+    """Base class for implementing an analyzer of uploaded files.
+
+    Analyzers compute statistics about a file while insert_file uploads it,
+    without a second pass over the data: update is called with each piece
+    of the file in order (on a worker thread), and result is called once the
+    upload is finished. The dict it returns is stored in the file's metadata.
+    If update or result raise an exception, the file is stored all the same,
+    with {"error": message} as its statistics. Analyzers for a file extension
+    are picked by insert_file when analyze is True (see register_analyzer).
     """
-    query = {}
-    size_query = {}
-    if id is not None:
-        query.update({"_id": id})
-    if format is not None:
-        query.update({_config["MAPS_FORMAT_ATTR"]: format})
-    if min_size is not None:
-        size_query.update({"$gte": min_size})
-    if max_size is not None:
-        size_query.update({"$lte": max_size})
-    if len(size_query) > 0:
-        query.update({_config["MAPS_SIZE_ATTR"]: size_query})
-
-    return list(
-        _MAPS.find(
-            query,
-            {
-                _config["MAPS_FORMAT_ATTR"]: 1,
-                _config["MAPS_SIZE_ATTR"]: 1,
-                _config["MAPS_BLOCK_SIZE_ATTR"]: 1,
-            },
-        )
-    )
-
 
-def get_map_snps(id):
-    """Retrive the SNPs a map contains in the form of list of internal IDs.
-
-    A tuple of two lists is returned, first one with the IDs sorted in the
-    map's original import order, and the second sorted by id value.
-
-    Parameters
-    ----------
-    id      The map's id.
-    """
-    cur = _MAPSNPS.find(
-        {_config["MAPSNPS_MAP_ATTR"]: id}, sort=[(_config["MAPSNPS_IDX_ATTR"], 1)]
-    )
-    snps, ssnps = [], []
-    for doc in cur:
-        snps.extend(doc[_config["MAPSNPS_LIST_ATTR"]])
-        ssnps.extend(doc[_config["MAPSNPS_SORTED_LIST_ATTR"]])
-    return snps, ssnps
+    @abstractmethod
+    def update(self, data):
+        """Analyze the next piece of the file, given as bytes."""
+        pass
 
+    @abstractmethod
+    def result(self):
+        """Finish the analysis and return its results as a dict."""
+        pass
 
-def find_individuals(id=None, tatoo=None, sample_map=None, sample_id=None):
-    """Search individuals in the database.
 
-    Returns a list of dicts, one for each individual in the result.
+class FastqIndexer(FileAnalyzer):
+    """Incremental indexer of FASTQ contents.
 
-    Parameters
-    ----------
-    id=None             Match only the individual with given internal id.
-    tatoo=None          Match only individuals which contain tatoo among
-                        their alternate IDs.
-    sample_map=None     Match only individuals that have data on specified map.
-    sample_id=None      Match only individuals that have the specified sample
-                        under some map.
+    Besides statistics about the reads and their qualities, it records the
+    offset of every every-th record. insert_file uses it to analyze and
+    index FASTQ files while uploading them (see read_fastq_records).
     """
-    query = {}
-    if id is not None:
-        query.update({"_id": id})
-    if tatoo is not None:
-        query.update({_config["INDIVIDUALS_ID_LIST_ATTR"]: tatoo})
-    if sample_map is not None:
-        attr = (
-            _config["INDIVIDUALS_SAMPLE_LIST_ATTR"] + "." + _config["SAMPLES_MAP_ATTR"]
-        )
-        query.update({attr: sample_map})
-    if sample_id is not None:
-        attr = (
-            _config["INDIVIDUALS_SAMPLE_LIST_ATTR"] + "." + _config["SAMPLES_ID_ATTR"]
-        )
-        query.update({attr: sample_id})
-    return list(_INDS.find(query))
-
 
-def find_individuals_of_snps(
-    id=None,
-    min_chrom=None,
-    max_chrom=None,
-    min_pos=None,
-    max_pos=None,
-    map=None,
-    iid=None,
-    chr=None,
-) -> list:
-    """Search individuals in the database, using a list of SNPs.
+    def __init__(self, every=None):
+        """Create an empty index.
 
-    Returns a list of dicts, one for each individual in the result.
-
-    Parameters
-    ----------
-    id=None          Match only SNPs with given name.
-    min_chrom=None   Match only SNPs with a chromosome that compares greater
-                     or equal to the one given.
-    max_chrom=None   Match only SNPs with a chromosome that compares lesser
-                     or equal to the one given.
-    min_pos=None     Match only SNPs with a position value that compares
-                     greater or equal than the one given.
-    max_pos=None     Match only SNPs with a position value that compares
-                     smaller or equal than the one given.
-    map=None         Match only SNPs that are contained within the map given.
-    iid=None         Match only the SNP with the given internal numeric id.
-    chr=None         Match only the SNPs with the given chromosome.
-    """
-    snps = find_snp(id, min_chrom, max_chrom, min_pos, max_pos, map, iid, chr)
-    # _SNPS -> _MAPS -> _SAMPLES -> _INDS
-    # Find maps of given SNPs
-    maps: list = list(
-        set(
-            [
-                map
-                for maps in [snp[_config["SNPS_MAPS_ATTR"]] for snp in snps]
-                for map in maps
-            ]
-        )
-    )
-    # Find samples of associated maps
-    if len(maps) == 0:
-        return []  # No associated maps -> no associated individuals
-    query_samples: dict = {"$or": [{_config["SAMPLES_MAP_ATTR"]: map} for map in maps]}
-    samples: list = _SAMPLES.find(query_samples)
-    # Find individuals of associated samples
-    map_attr: str = str(
-        _config["INDIVIDUALS_SAMPLE_LIST_ATTR"] + "." + _config["SAMPLES_MAP_ATTR"]
-    )
-    id_attr: str = str(
-        _config["INDIVIDUALS_SAMPLE_LIST_ATTR"] + "." + _config["SAMPLES_ID_ATTR"]
-    )
-    query_individuals: dict = {
-        "$or": [{map_attr: sample["map"], id_attr: sample["id"]} for sample in samples]
-    }
-    return list(_INDS.find(query_individuals))
-
-
-def find_snp_of_sample(mapname, sample, snp_id):
-    """Fetch SNP data of a given sample from a given map.
-
-    Returns a dict with all data available.
-    Parameters
-    ----------
-    mapname     Map to use.
-    sample      Sample id within map.
-    snp_id      Internal id of the SNP to fetch.
-    """
-    GEN = _config["SNPBLOCKS_GENOTYPE"]
-    BLOCK_SIZE = _config["MAPS_BLOCK_SIZE_ATTR"]
-    SORTED_SNPS = _config["MAPSNPS_SORTED_LIST_ATTR"]
-    IDX = _config["MAPSNPS_IDX_ATTR"]
-    MAX_LIST_SIZE = _config["MAPSNPS_MAX_LIST_SIZE"]
-    MAP = _config["MAPSNPS_MAP_ATTR"]
-    try:
-        map = find_maps(id=mapname)[0]
-        pipeline = [
-            {"$match": {MAP: mapname}},
-            {
-                "$project": {
-                    "idx": {"$indexOfArray": ["$" + SORTED_SNPS, snp_id]},
-                    IDX: 1,
-                }
+        Attributes
+        ----------
+        every=None  The offset of one of every this many records is stored.
+                    If None, only the statistics are computed.
+        """
+        self.every = every
+        self.offsets = []
+        self.reads = 0
+        self.length_counts = {}
+        self.quality_counts = Counter()
+        self._lines = 0
+        self._pos = 0
+        self._partial = b""
+
+    def update(self, data):
+        """Index the next piece of the file."""
+        lines = (self._partial + data).split(b"\n")
+        self._partial = lines.pop()
+        for line in lines:
+            self.__line(line)
+
+    def result(self):
+        """Finish indexing and return the read statistics as a dict."""
+        if len(self._partial) > 0:
+            self.__line(self._partial)
+            self._partial = b""
+        if self._lines % 4 != 0:
+            raise Exception("Truncated FASTQ record.")
+        # Phred+33 encoded qualities.
+        bases = sum(self.quality_counts.values())
+        quality_sum = sum((q - 33) * n for q, n in self.quality_counts.items())
+        return {
+            "reads": self.reads,
+            "bases": bases,
+            "length_counts": {str(k): v for k, v in sorted(self.length_counts.items())},
+            "min_length": min(self.length_counts, default=0),
+            "max_length": max(self.length_counts, default=0),
+            "mean_length": bases / max(self.reads, 1),
+            "quality_counts": {
+                str(q - 33): n for q, n in sorted(self.quality_counts.items())
             },
-        ]
-        for part in _MAPSNPS.aggregate(pipeline):
-            if part["idx"] != -1:
-                index = part["idx"] + part[IDX] * MAX_LIST_SIZE
-                blk = index // map[BLOCK_SIZE]
-                pos = index % map[BLOCK_SIZE]
-                break
-
-        block = _SNPBLOCKS.find_one(
-            {
-                _config["SNPBLOCKS_MAP_ATTR"]: mapname,
-                _config["SNPBLOCKS_BLOCK_NUMBER"]: blk,
-                _config["SNPBLOCKS_SAMPLE_ATTR"]: sample,
-            }
-        )
+            "mean_quality": quality_sum / max(bases, 1),
+        }
 
-    except (IndexError, ValueError, UnboundLocalError):
-        return None
+    def __line(self, line):
+        pos = self._pos
+        self._pos += len(line) + 1
+        line = line.rstrip(b"\r")
+        kind = self._lines % 4
+        if kind == 0:
+            if len(line) == 0:
+                return
+            if line[:1] != b"@":
+                raise Exception("Invalid FASTQ record.")
+            if self.every is not None and self.reads % self.every == 0:
+                self.offsets.append(pos)
+            self.reads += 1
+        elif kind == 1:
+            self.length_counts[len(line)] = self.length_counts.get(len(line), 0) + 1
+        elif kind == 3:
+            self.quality_counts.update(line)
+        self._lines += 1
+
+
+class VcfAnalyzer(FileAnalyzer):
+    """Counts the samples and variants (per chromosome) of a VCF file."""
+
+    def __init__(self):
+        self.samples = 0
+        self.chromosomes = {}
+        self._partial = b""
+
+    def update(self, data):
+        lines = (self._partial + data).split(b"\n")
+        self._partial = lines.pop()
+        for line in lines:
+            self.__line(line)
+
+    def result(self):
+        self.__line(self._partial)
+        self._partial = b""
+        return {
+            "samples": self.samples,
+            "variants": sum(self.chromosomes.values()),
+            "chromosomes": [
+                {"chrom": chrom, "variants": n} for chrom, n in self.chromosomes.items()
+            ],
+        }
 
-    if block is None:
-        return None
-    res = {}
-    for key in block[GEN]:
-        if block[GEN][key][0] == " ":
-            res[key] = block[GEN][key].split()[pos]
-        else:
-            res[key] = block[GEN][key][pos]
-    return res
+    def __line(self, line):
+        if line.startswith(b"#CHROM"):
+            self.samples = max(len(line.split()) - 9, 0)
+        elif len(line.strip()) > 0 and not line.startswith(b"#"):
+            chrom = line.split(b"\t", 1)[0].decode()
+            self.chromosomes[chrom] = self.chromosomes.get(chrom, 0) + 1
 
 
-def find_sample(id=None, map=None):
-    """Search samples in the database.
+class ImageAnalyzer(FileAnalyzer):
+    """Reads the format and dimensions of PNG, GIF, BMP and JPEG images.
 
-    Parameters
-    ----------
-    id=None     Match samples with the specified within-map id for some map.
-    map=None    Match samples which contain data under the specified map.
+    Only the beginning of the file, up to the image's dimensions, is kept.
     """
-    query = {}
-    if id is not None:
-        query[_config["SAMPLES_ID_ATTR"]] = id
-    if map is not None:
-        query[_config["SAMPLES_MAP_ATTR"]] = map
-    return list(_SAMPLES.find(query))
-
 
-def get_sample_data(id, map):
-    """Retrive sample data.
-
-    The data is returned as a dict, following the same format produced by
-    the SampleWriter used to import it.
-
-    Parameters
-    ----------
-    id   The sample within-map id.
-    map  The sample's associated map.
-    """
-    samples = find_sample(id, map)
-    if len(samples) > 1:
-        raise Exception("Homonymous samples within the same map.")
-    if len(samples) == 0:
+    _MAX_HEADER = 2**20
+
+    def __init__(self):
+        self._header = b""
+        self._result = None
+
+    def update(self, data):
+        if self._result is None and len(self._header) < self._MAX_HEADER:
+            self._header += data[: self._MAX_HEADER - len(self._header)]
+            self._result = self.__parse(self._header)
+
+    def result(self):
+        if self._result is None:
+            return {"format": None}
+        return self._result
+
+    @staticmethod
+    def __parse(h):
+        if h[:8] == b"\x89PNG\r\n\x1a\n" and len(h) >= 24:
+            width, height = struct.unpack(">II", h[16:24])
+            return {"format": "PNG", "width": width, "height": height}
+        if h[:6] in (b"GIF87a", b"GIF89a") and len(h) >= 10:
+            width, height = struct.unpack("<HH", h[6:10])
+            return {"format": "GIF", "width": width, "height": height}
+        if h[:2] == b"BM" and len(h) >= 26:
+            width, height = struct.unpack("<ii", h[18:26])
+            return {"format": "BMP", "width": width, "height": abs(height)}
+        if h[:2] == b"\xff\xd8":
+            # Walk the JPEG segments up to the first start of frame.
+            i = 2
+            while i + 4 <= len(h) and h[i] == 0xFF:
+                marker = h[i + 1]
+                if marker == 0xFF:
+                    i += 1
+                    continue
+                if marker == 0x01 or 0xD0 <= marker <= 0xD8:
+                    i += 2
+                    continue
+                if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+                    if i + 9 > len(h):
+                        return None
+                    height, width = struct.unpack(">HH", h[i + 5 : i + 9])
+                    return {"format": "JPEG", "width": width, "height": height}
+                i += 2 + struct.unpack(">H", h[i + 2 : i + 4])[0]
         return None
-    # sample = samples[0]
-
-    maps = find_maps(id=map)
-    if len(maps) == 0:
-        raise Exception("Sample map data is missing.")
-    if len(maps) > 1:
-        raise Exception("Homonymous maps with the same ID.")
-    m = maps[0]
-    snps, sorted_snps = get_map_snps(map)
-
-    SNPBLOCKS_MAP = _config["SNPBLOCKS_MAP_ATTR"]
-    SNPBLOCKS_SAMPLE = _config["SNPBLOCKS_SAMPLE_ATTR"]
-    SNPBLOCKS_NO = _config["SNPBLOCKS_BLOCK_NUMBER"]
-    blocks = _SNPBLOCKS.find(
-        {SNPBLOCKS_MAP: map, SNPBLOCKS_SAMPLE: id}, sort=[(SNPBLOCKS_NO, 1)]
-    )
-    genotype = {}
-    for block in blocks:
-        g = block[_config["SNPBLOCKS_GENOTYPE"]]
-        for key in g:
-            if g[key][0] == " ":
-                data = g[key].split()
-            else:
-                data = list(g[key])
-            if key not in genotype:
-                genotype[key] = []
-            genotype[key].extend(data)
-
-    where = {}
-    for i, snp_id in enumerate(snps):
-        where[snp_id] = i
-
-    perm = [where[snp_id] for snp_id in sorted_snps]
-
-    for key in genotype:
-        if len(genotype[key]) != m[_config["MAPS_SIZE_ATTR"]]:
-            raise Exception("Sample genotype and map size mismatch.")
-        genotype[key] = [x for _, x in sorted(zip(perm, genotype[key]))]
-
-    return genotype
-
-
-def insert_file(file, **kwargs):
-    """Upload a file to the database, optionally linking it to an individual.
-
-    Parameters
-    ----------
-    file                    File-like object to import
-    **kwargs                (optional) Metadata below may be passed as kwargs
-    individual_id           Identifier of the individual associated with the
-                            the file. It has no special meaning, except for the
-                            summarize method, which considers that a file is
-                            associated with an individual iif this value is
-                            equal to its internal id.
-    file_type               Type of inserted file (FastQ, Image, etc)
-    description             Description of the inserted file
-    """
-    _GFS.put(file, filename=os.path.basename(file.name), metadata=kwargs)
-
-
-def list_files(**kwargs):
-    """Search files in the database.
-
-    Returns a list of dicts, each one containing metadata from
-    a file.
-
-    Parameters
-    ----------
-    **kwargs                (optional) Metadata below may be passed as kwargs
-    individual_id           Match only files with the specified individual_id.
-    filename                Match only files with the specified filename
-    file_type               Match only files with the specified file type.
-    description             Match only files with the specified description.
-    """
-    # Dictionary to match arguments with config file constants
-    dictionary = {
-        "filename": _config["FILES_FILENAME"],
-        "individual_id": "metadata." + _config["FILES_INDIVIDUAL_ATTR"],
-        "file_type": "metadata." + _config["FILES_TYPE"],
-        "description": "metadata." + _config["FILES_DESCRIPTION"],
-    }
-    # Building query
-    query = {}
-    try:
-        query = {dictionary[k]: kwargs[k] for k in kwargs}
-    except KeyError as e:
-        print("Warning: invalid keyword argument:", e)
-        print("Expected kwargs:", dictionary.keys)
-
-    return list(_db.fs.files.find(query, {"chunkSize": 0}))
-
-
-def get_files(files):
-    """Download a list of files from the database.
-
-    The files are downloaded to the current working directory,
-    maintaning their original names. Already existing files
-    will be overwritten. If two files with the same name
-    are specified, one will overwrite the other.
 
-    Parameters
-    ----------
-    files   List of dicts describing the files to download, such as the one
-            returned by list_files. Each dict must contain the "_id" field
-            of the file to download.
-    """
-    for file_doc in files:
-        grid_out = _GFS.get(file_doc["_id"])
-        filename = grid_out.filename
-        with open(filename, "wb+") as f:
-            f.write(grid_out.read())
-
-
-def import_map(
-    map_reader,
-    map_name,
-    force_create_new=False,
-    force_use_existing=False,
-    report=False,
-    rebuild_indexes=False,
-):
-    """Import map into the database using a MapReader.
-
-    Parameters
-    ----------
-    map_reader                  A MapReader instance.
-    map_name                    The identifier the map will have inside the
-                                database.
-    force_create_new=False      If False, for each SNP being imported, tries
-                                to find similar SNPs already on the database.
-                                If at least one is found, the user is asked
-                                to choose between creating a new SNP or using
-                                one of the similars found.
-                                SNPs are considered similar if their
-                                chromosomes and positions match exactly.
-                                If True, new SNPs are always created.
-    force_use_existing=False    If True, will always try to use similar
-                                (see parameter above) SNPs instead of creating
-                                new ones. If only one similar SNP is found, it
-                                is used automatically. If more than one is
-                                found, the user is asked to choose. If none is
-                                found, a new SNP is created. This and the
-                                previous parameter cannot be True at the same
-                                time.
-    report=False                If True, import results are printed after
-                                finished. If False, nothing is printed.
-    rebuild_indexes=False       If True, drop index before import, recreate
-                                after finishing the operation.
-                                Warning: only use this option if a large volume
-                                of data is being imported, as recreating an index
-                                takes may take a large amount of time.
-    """
-
-    if len(find_maps(id=map_name)) > 0:
-        raise Exception("Map name already in use.")
-
-    # Determine internal IDs for each SNP, possibly with user
-    # interaction.
-    nsnps = len(map_reader)
-    snp_ids = __fill_snp_ids(map_reader, force_create_new, force_use_existing)
-
-    if snp_ids is None:
-        return
-
-    # Drop indexes if rebuild_indexes is True
-    if rebuild_indexes:
-        _MAPS.drop_indexes()
-        _MAPSNPS.drop_indexes()
-        _SNPS.drop_indexes()
-    # Insert new map into maps collection.
-    map_doc = {
-        "_id": map_name,
-        _config["MAPS_SIZE_ATTR"]: nsnps,
-        _config["MAPS_BLOCK_SIZE_ATTR"]: _config["SNPBLOCKS_SNPS_PER_BLOCK"],
-    }
-    map_doc.update(map_reader.map_meta())
-    _MAPS.insert_one(map_doc)
-
-    # Insert map snp list (both original order and sorted by id)
-    # into map snps collection.
-    BS = _config["MAPSNPS_MAX_LIST_SIZE"]
-    snp_list = [x[0] for x in snp_ids]
-    s_snp_list = sorted(snp_list)
-    _MAPSNPS.insert_many(
-        (
-            {
-                _config["MAPSNPS_MAP_ATTR"]: map_name,
-                _config["MAPSNPS_IDX_ATTR"]: i,
-                _config["MAPSNPS_LIST_ATTR"]: snp_list[i * BS : i * BS + BS],
-                _config["MAPSNPS_SORTED_LIST_ATTR"]: s_snp_list[i * BS : i * BS + BS],
-            }
-            for i in range(0, (nsnps - 1) // BS + 1)
-        )
-    )
-
-    # Insert new SNPs into snps collection.
-    new_snps = [
-        __adjust_snp(snp, map_reader, snp_ids[i][0])
-        for (i, snp) in enumerate(map_reader)
-        if snp_ids[i][1]
-    ]
-    if len(new_snps) > 0:
-        _SNPS.insert_many(new_snps)
-
-    # For each SNP (old or new), add the new map to the SNP's map list.
-    _SNPS.bulk_write(
-        [
-            UpdateOne(
-                {"_id": snp_ids[j][0]}, {"$push": {_config["SNPS_MAPS_ATTR"]: map_name}}
-            )
-            for j in range(nsnps)
-        ]
-    )
-
-    # Create indexes if rebuild_indexes is True
-    if rebuild_indexes:
-        _MAPS.create_index("_id")
-        _MAPSNPS.create_index("_id")
-        _MAPSNPS.create_index([("map", ASCENDING), ("i", ASCENDING)], unique=True)
-        _SNPS.create_index("_id")
-        _SNPS.create_index("i")
-        _SNPS.create_index([("c", ASCENDING), ("p", ASCENDING)])
-        _SNPS.create_index("m")
-
-    if report:
-        print(
-            f"Added map {map_name} with {nsnps} SNPs, "
-            + f"{len(new_snps)} new SNPs created."
-        )
 
+def read_config(path="config.js"):
+    """Load configuration file and return its contents.
 
-def import_samples(
-    sample_reader, map_name, id_map={}, report=False, rebuild_indexes=False
-):
-    """Import samples into the database using a SampleReader.
+    The configuration file a JSON file, except that it begins with an
+    assignment: config = {JSON...}
+    This is so it can also be used by mongo_setup.js, which runs on the
+    MongoDB shell.
+    Returns a dict with the contents of the JSON.
 
-    Parameters
+    Attributes
     ----------
-    sample_reader               A SampleReader instance.
-    map_name                    The map id associated with the samples being imported.
-                                Must exist on the database.
-    id_map={}                   A dict associating sample IDs (key) with individual
-                                tatoos (value). Sample IDs which have an associated
-                                individual tatoo will be associated to the individual
-                                in question. If it doesn't exist, it'll be created.
-                                If more than one exists with the same tatoo, the user
-                                will be asked to choose between them.
-    report=False                If True, import results are printed after finished.
-                                IF False, nothing is printed.
-    rebuild_indexes=False       If True, drop index before import, recreate
-                                after finishing the operation.
-                                Warning: only use this option if a large volume
-                                of data is being imported, as recreating an index
-                                takes may take a large amount of time.
+    path="config.js"    Path to the configuration file.
     """
-    try:
-        m = find_maps(id=map_name)[0]
-    except IndexError:
-        raise Exception("Map not found.") from None
-
-    snps, sorted_snps = get_map_snps(map_name)
-    bsize = m[_config["MAPS_BLOCK_SIZE_ATTR"]]
-
-    new_samples = 0
-    new_blocks = 0
-    new_individuals = 0
-    old_individuals = 0
-
-    # Drop indexes if rebuild_indexes is True
-    if rebuild_indexes:
-        _SAMPLES.drop_indexes()
-        _SNPBLOCKS.drop_indexes()
-        _INDS.drop_indexes()
-
-    for sample in sample_reader:
-        genotype = sample.pop(sample_reader.SAMPLE_GENOTYPE)
-        id = sample.pop(sample_reader.SAMPLE_ID)
-
-        for key in genotype:
-            if len(genotype[key]) != len(snps):
-                raise Exception("Sample genotype and map size mismatch.")
-
-        # Prepare sample object to be inserted.
-        sample_key = {
-            _config["SAMPLES_MAP_ATTR"]: map_name,
-            _config["SAMPLES_ID_ATTR"]: id,
-        }
-        sample.update(sample_key)
-
-        _SAMPLES.insert_one(sample)
-        new_samples += 1
-
-        # Sort genotype lists using snp id as key.
-        for key in genotype:
-            if isinstance(genotype[key], str):
-                genotype[key] = "".join(
-                    [x for _, x in sorted(zip(snps, genotype[key]))]
-                )
-            else:
-                genotype[key] = [str(x) for _, x in sorted(zip(snps, genotype[key]))]
-
-        # Break genotype into blocks and insert into SNP blocks collection.
-        current_block = 0
-        for i in range(0, len(snps), bsize):
-            b_genotype = {}
-            for key in genotype:
-                if isinstance(genotype[key], str):
-                    b_genotype[key] = genotype[key][i : i + bsize]
-                else:
-                    b_genotype[key] = " " + " ".join(genotype[key][i : i + bsize])
-            _SNPBLOCKS.insert_one(
-                {
-                    _config["SNPBLOCKS_MAP_ATTR"]: map_name,
-                    _config["SNPBLOCKS_SAMPLE_ATTR"]: id,
-                    _config["SNPBLOCKS_BLOCK_NUMBER"]: current_block,
-                    _config["SNPBLOCKS_GENOTYPE"]: b_genotype,
-                }
-            )
-            new_blocks += 1
-            current_block += 1
-
-        # Try to associate the sample with an individual, possibly
-        # interacting with the user.
-        if id in id_map:
-            individuals = find_individuals(tatoo=id_map[id])
-            option = 0
-            if len(individuals) > 1:
-                option = __user_individual_choice(id_map[id], individuals)
-            elif len(individuals) == 1:
-                option = 1
-            if option == 0:
-                _INDS.insert_one(
-                    {
-                        "_id": __next_individual_id(),
-                        _config["INDIVIDUALS_ID_LIST_ATTR"]: [id_map[id]],
-                        _config["INDIVIDUALS_SAMPLE_LIST_ATTR"]: [sample_key],
-                    }
-                )
-                new_individuals += 1
+    s = ""
+    with open(path, "r") as f:
+        jsonBegin = False
+        for line in f:
+            if jsonBegin:
+                s += line
             else:
-                _INDS.update_one(
-                    {"_id": individuals[option - 1]["_id"]},
-                    {"$push": {_config["INDIVIDUALS_SAMPLE_LIST_ATTR"]: sample_key}},
-                )
-                old_individuals += 1
-
-    # Create indexes if rebuild_indexes is True
-    if rebuild_indexes:
-        _SAMPLES.create_index("_id")
-        _SAMPLES.create_index([("map", ASCENDING), ("id", ASCENDING)], unique=True)
-        _SAMPLES.create_index("id")
-        _SNPBLOCKS.create_index("_id")
-        _SNPBLOCKS.create_index([("m", ASCENDING), ("s", ASCENDING), ("no", ASCENDING)])
-        _INDS.create_index("_id")
-        _INDS.create_index("tatoos")
-        _INDS.create_index("samples.map")
-        _INDS.create_index("samples.id")
-
-    if report:
-        print(
-            f"{new_samples} samples added, {new_blocks} blocks, "
-            + f"{new_individuals} individuals created, "
-            + f"{old_individuals} pre-existing individuals updated."
-        )
-
-
-def export_map(id, map_writer, out_file_path):
-    """Export map from database to file using a MapWriter.
-
-    The SNPs of the map to be exported should contain
-    all the fields required by the specific MapWriter.
+                open_bracket = line.find("{")
+                if open_bracket != -1:
+                    jsonBegin = True
+                    s += line[open_bracket:]
+    return json.loads(s)
 
-    Parameters
-    ----------
-    id              Name of the map in the database to export.
-    map_writer      A MapWriter instance.
-    out_file_path   Path of file to export to.
-    """
-    snps, _ = get_map_snps(id)
-    if len(snps) == 0:
-        raise Exception("Map not found.")
-    where = dict()
-    for i in range(len(snps)):
-        where[snps[i]] = i
-    wsnps = [None] * len(snps)
-    for snp in _SNPS.find({_config["SNPS_MAPS_ATTR"]: id}):
-        wsnps[where[snp["_id"]]] = snp
-    for snp in wsnps:
-        __rev_adjust_snp(snp, map_writer)
-    writer = map_writer(wsnps)
-    writer.write(out_file_path)
-
-
-def export_samples(samples, map, sample_writer, out_file_path):
-    """Export samples to file using a SampleWriter.
-
-    The samples to be exported should contain all the fields required by
-    the specific SampleWriter.
 
-    Parameters
-    ----------
-    samples         List containing within-map IDs of samples to be exported.
-                    If empty, all the samples associated with the map will be
-                    exported.
-    map             ID of map with which samples to be exported are associated.
-    sample_writer   A SampleWriter instance.
-    out_file_path   Path of file to export to.
-    """
-    # TODO: optimize performance by reducing number of calls to find_sample.
-    wsamples = []
-    if len(samples) == 0:
-        samples = [
-            sample[_config["SAMPLES_ID_ATTR"]] for sample in find_sample(map=map)
-        ]
-    for id in samples:
-        current = {
-            sample_writer.SAMPLE_ID: id,
-            sample_writer.SAMPLE_GENOTYPE: get_sample_data(id, map),
-        }
-        sample_info = find_sample(id, map)[0]
-        sample_info.pop("_id")
-        current.update(sample_info)
-        wsamples.append(current)
-    writer = sample_writer(wsamples)
-    writer.write(out_file_path)
-
-
-def summarize(individuals: Union[dict, list]) -> list:
-    """Summarizes all data about an individual.
-
-    Returns a list of dicts with the following keys:
-    <map format>_sample:<str,str list>     list of maps the individual is in,
-                                for that format, with sample ids
-    <map format>_sample_count: <int>   count of maps the individual is in,
-                                for that format
-    <map format>_snps_count: <int> count of snps of individual, for that format
-    files: <str list>           list of file names associated with
-                                the individual
-    <file type>_file_count: <int>          count of files associated with the
-                                individual
+# Size of the reads made when streaming files to and from GridFS.
+_CHUNK_SIZE = 255 * 1024
+
+# File analyzers by extension (see register_analyzer).
+_ANALYZERS = {
+    ".fastq": FastqIndexer,
+    ".fq": FastqIndexer,
+    ".vcf": VcfAnalyzer,
+    ".png": ImageAnalyzer,
+    ".gif": ImageAnalyzer,
+    ".bmp": ImageAnalyzer,
+    ".jpg": ImageAnalyzer,
+    ".jpeg": ImageAnalyzer,
+}
+
+
+# Write concerns that can be named in the configuration (WRITE_CONCERN) and
+# in the write_concern parameters below.
+_WRITE_CONCERNS = {
+    "unacknowledged": {"w": 0},
+    "acknowledged": {"w": 1},
+    "journaled": {"w": 1, "j": True},
+    "majority": {"w": "majority"},
+}
+
+# Read preferences that can be named in the configuration (READ_PREFERENCE)
+# and in the read_preference parameters below.
+_READ_PREFERENCES = {
+    "primary": ReadPreference.PRIMARY,
+    "primaryPreferred": ReadPreference.PRIMARY_PREFERRED,
+    "secondary": ReadPreference.SECONDARY,
+    "secondaryPreferred": ReadPreference.SECONDARY_PREFERRED,
+    "nearest": ReadPreference.NEAREST,
+}
+
+# Number of documents sent per insert_many by import_samples under bulk_load.
+_INSERT_BATCH_SIZE = 256
+
+# How many times, and how many seconds apart, bulk_load counts the documents
+# before reporting a mismatch (unacknowledged writes may still be applied).
+_VERIFY_ATTEMPTS = 10
+_VERIFY_INTERVAL = 0.5
+
+
+def register_analyzer(analyzer_class, *extensions):
+    """Set the analyzer used by insert_file for files with the given extensions.
 
     Parameters
     ----------
-    individual      dict or list of dicts representing an individual, as
-                    returned by find_individuals or find_individuals_of_snps
+    analyzer_class  A class derived from FileAnalyzer, which is instantiated
+                    without arguments for each file analyzed, or None to stop
+                    analyzing files with these extensions.
+    *extensions     File name extensions, such as ".fastq".
     """
-    result: list = []
-    # Check if individuals is a dict or a list. Return accordingly
-    if isinstance(individuals, dict):
-        individuals = [individuals]
-
-    for ind in individuals:
-        ind_result: dict = {"individual_id": ind["_id"], "files": [], "files_count": 0}
-        maps: dict = {}  # dict of maps to retrieve number of snps from
-        # Retrieving maps/samples with formats
-        for sample in ind[_config["INDIVIDUALS_SAMPLE_LIST_ATTR"]]:
-            map_name: str = sample[_config["SAMPLES_MAP_ATTR"]]
-            sample_id: str = sample[_config["SAMPLES_ID_ATTR"]]
-            try:
-                map_format: str = find_maps(id=map_name)[0][_config["MAPS_FORMAT_ATTR"]]
-            except IndexError:
-                print(f"Warning: couldn't retrieve format for map {map_name}")
-            else:
-                maps.setdefault(map_format, set())
-                maps[map_format].add(map_name)
-                ind_result[map_format + "_sample_count"] = (
-                    ind_result.get(map_format + "_sample_count", 0) + 1
-                )
-                ind_result[map_format + "_sample"] = ind_result.get(
-                    map_format + "_sample", []
-                ) + [(map_name, sample_id)]
-        # Retrieving snps associated with ind
-        for map_format in maps.keys():
-            query_snps: dict = {
-                _config["SNPS_MAPS_ATTR"]: {"$in": list(maps[map_format])}
-            }
-            ind_result[map_format + "_snps_count"] = _SNPS.count_documents(
-                filter=query_snps
-            )
-        # Retrieving files of individual
-        files = list_files(individual_id=ind["_id"])
-        ind_result["files"] = []
-        for f in files:
-            try:
-                ind_result["files"].append(f["filename"])
-            except KeyError as e:
-                print(
-                    "Warning (",
-                    e,
-                    "): couldn't retrieve filename for file associated with",
-                    f"individual {ind['_id']}",
-                )
-            # Retrieving count of files by type
-            try:
-                ind_result[f["metadata"][_config["FILES_TYPE"]] + "_file_count"] = (
-                    ind_result.get(
-                        f["metadata"][_config["FILES_TYPE"]] + "_file_count", 0
-                    )
-                    + 1
-                )
-            except KeyError as e:
-                print(
-                    "Warning (",
-                    e,
-                    "): couldn't retrieve file type for file associated with",
-                    f"individual {ind['_id']}",
-                )
-        # Appending individual summary to result
-        result.append(ind_result)
-    return result
-
-
-# Used for testing purposes.
-def get_db_stats(scale=1):
-    colls = [_config[key] for key in _config if key[-4:] == "COLL"]
-    for coll in colls:
-        _db.command("validate", coll, full=True)
-    return _db.command("dbstats", scale=scale)
-
-
-# Used for testing purposes.
-# def create_individuals(individuals):
-#    _INDS.insert_many(individuals)
-
-
-def __reserve_snp_ids(cnt):
-    doc = _COUNTERS.find_one_and_update(
-        {"_id": _config["SNPS_COLL"]},
-        {"$inc": {_config["COUNTERS_SEQ_VALUE_ATTR"]: cnt}},
-    )
-    return doc[_config["COUNTERS_SEQ_VALUE_ATTR"]]
-
-
-def __adjust_snp(snp, map_reader, id=None):
-    if id is not None:
-        snp["_id"] = id
-    if map_reader.SNP_NAME in snp:
-        snp[_config["SNPS_NAME_ATTR"]] = snp.pop(map_reader.SNP_NAME)
-    if map_reader.SNP_CHROM in snp:
-        snp[_config["SNPS_CHROMOSOME_ATTR"]] = snp.pop(map_reader.SNP_CHROM)
-    if map_reader.SNP_POS in snp:
-        snp[_config["SNPS_POSITION_ATTR"]] = snp.pop(map_reader.SNP_POS)
-    return snp
-
-
-def __rev_adjust_snp(snp, map_writer):
-    snp.pop("_id")
-    if _config["SNPS_NAME_ATTR"] in snp:
-        snp[map_writer.SNP_NAME] = snp.pop(_config["SNPS_NAME_ATTR"])
-    if _config["SNPS_CHROMOSOME_ATTR"] in snp:
-        snp[map_writer.SNP_CHROM] = snp.pop(_config["SNPS_CHROMOSOME_ATTR"])
-    if _config["SNPS_POSITION_ATTR"] in snp:
-        snp[map_writer.SNP_POS] = snp.pop(_config["SNPS_POSITION_ATTR"])
-
-
-def __find_similar_snps(snp):
-    query = {}
-    for attr in [_config["SNPS_CHROMOSOME_ATTR"], _config["SNPS_POSITION_ATTR"]]:
-        if attr not in snp:
-            return []
-        query[attr] = snp[attr]
-    return list(_SNPS.find(query))
+    for ext in extensions:
+        if analyzer_class is None:
+            _ANALYZERS.pop(ext.lower(), None)
+        else:
+            _ANALYZERS[ext.lower()] = analyzer_class
 
 
-def __user_snp_choice(snp, conflicts, force_use_existing):
+def _user_snp_choice(snp, conflicts, force_use_existing):
     # id = -1
     print(str(snp) + " is similar to the following database SNPs:")
     i = 1
@@ -1230,42 +627,255 @@ def __user_snp_choice(snp, conflicts, force_use_existing):
     return resp
 
 
-def __fill_snp_ids(map_reader, force_create_new, force_use_existing):
-    if force_create_new and force_use_existing:
-        raise Exception(
-            "force_create_new and force_use_existing cannot" " be used simultaneously."
+def _chunks(values, size):
+    for i in range(0, len(values), size):
+        yield values[i : i + size]
+
+
+def _paged_find(coll, query, projection, batch_size, limit, skip, after):
+    if after is not None:
+        query = {"$and": [query, {"_id": {"$gt": after}}]}
+    cursor = coll.find(query, projection)
+    if after is not None or skip:
+        cursor = cursor.sort("_id", ASCENDING)
+    if skip:
+        cursor = cursor.skip(skip)
+    if limit:
+        cursor = cursor.limit(limit)
+    if batch_size:
+        cursor = cursor.batch_size(batch_size)
+    return cursor
+
+
+def _with_field(projection, field):
+    # Adds a field to a find projection, given as a list or a dict.
+    if isinstance(projection, dict):
+        projection = dict(projection)
+        if any(v for k, v in projection.items() if k != "_id"):
+            projection[field] = 1
+        else:
+            projection.pop(field, None)
+        return projection
+    return list(projection) + [field] if field not in projection else projection
+
+
+def _decode_genotype_list(chunks):
+    if chunks[0][:1] == " ":
+        return "".join(chunks).split()
+    return list("".join(chunks))
+
+
+def _decode_genotype_array(chunks):
+    # Decodes the block strings of a genotype key straight from their bytes.
+    # The dtype depends on how the genotypes are stored:
+    # - single-character strings ("0121..."): uint8 character codes;
+    # - " v1 v2 v3..." with numeric values, whatever their width: float32;
+    # - " v1 v2 v3..." with other values of width 1: uint8 character codes;
+    # - " v1 v2 v3..." with other values of a fixed width n: S{n};
+    # - anything else: bytes of varying width.
+    if chunks[0][:1] != " ":
+        return np.frombuffer("".join(chunks).encode("latin-1"), dtype=np.uint8)
+    text = "".join(chunks)
+    # Each value is preceded by a single space.
+    count = text.count(" ")
+    try:
+        numbers = np.fromstring(text, dtype=np.float32, sep=" ")
+        if len(numbers) == count:
+            return numbers
+    except ValueError:
+        pass
+    raw = text.encode("latin-1")
+    end = text.find(" ", 1)
+    width = (len(text) if end == -1 else end) - 1
+    if width > 0 and len(raw) == count * (width + 1):
+        cells = np.frombuffer(raw, dtype=np.uint8).reshape(count, width + 1)
+        if (cells[:, 0] == ord(" ")).all():
+            cells = cells[:, 1:]
+            if width == 1:
+                return cells.ravel().copy()
+            return np.ascontiguousarray(cells).view(f"S{width}").ravel()
+    return np.array(text.split(), dtype=np.bytes_)
+
+
+def _summary_result(doc):
+    # Convert a materialized summary into the format returned by summarize.
+    ind_result = {"individual_id": doc["_id"], "files": [], "files_count": 0}
+    for sample in doc.get("samples", []):
+        map_format = sample["format"]
+        ind_result[map_format + "_sample_count"] = (
+            ind_result.get(map_format + "_sample_count", 0) + 1
+        )
+        ind_result[map_format + "_sample"] = ind_result.get(
+            map_format + "_sample", []
+        ) + [(sample["map"], sample["id"])]
+    for m in doc.get("maps", []):
+        ind_result[m["format"] + "_snps_count"] = (
+            ind_result.get(m["format"] + "_snps_count", 0) + m["size"]
+        )
+    for f in doc.get("files", []):
+        if f["filename"] is not None:
+            ind_result["files"].append(f["filename"])
+        if f["type"] is not None:
+            ind_result[f["type"] + "_file_count"] = (
+                ind_result.get(f["type"] + "_file_count", 0) + 1
+            )
+    return ind_result
+
+
+def _start_analyzer(analyzer):
+    # Runs analyzer.update on a worker thread over the pieces passed to the
+    # first function returned. The second one waits for the worker and
+    # returns analyzer.result(), or {"error": message} if the analyzer failed.
+    pieces = queue.Queue(maxsize=16)
+    errors = []
+
+    def work():
+        data = pieces.get()
+        while data is not None:
+            if len(errors) == 0:
+                try:
+                    analyzer.update(data)
+                except Exception as e:
+                    errors.append(e)
+            data = pieces.get()
+
+    def analysis(wait_only=False):
+        pieces.put(None)
+        worker.join()
+        if wait_only:
+            return None
+        if len(errors) == 0:
+            try:
+                return analyzer.result()
+            except Exception as e:
+                errors.append(e)
+        return {"error": str(errors[0])}
+
+    worker = threading.Thread(target=work, daemon=True)
+    worker.start()
+    return pieces.put, analysis
+
+
+def _codec(codec):
+    # Returns the (compress, decompress) functions of a codec.
+    if codec == "gzip":
+        return gzip.compress, gzip.decompress
+    if codec == "zstd":
+        try:
+            import zstandard
+        except ImportError:
+            raise Exception("The zstd codec requires the zstandard package.")
+        return (
+            lambda data: zstandard.ZstdCompressor().compress(data),
+            lambda data: zstandard.ZstdDecompressor().decompress(data),
+        )
+    raise Exception("Unknown codec.")
+
+
+def _write_concern(write_concern):
+    # Returns the WriteConcern for a name in _WRITE_CONCERNS.
+    if isinstance(write_concern, WriteConcern):
+        return write_concern
+    if write_concern not in _WRITE_CONCERNS:
+        raise Exception("Unknown write concern.")
+    return WriteConcern(**_WRITE_CONCERNS[write_concern])
+
+
+def _read_preference(read_preference):
+    # Returns the read preference for a name in _READ_PREFERENCES.
+    if read_preference in _READ_PREFERENCES.values():
+        return read_preference
+    if read_preference not in _READ_PREFERENCES:
+        raise Exception("Unknown read preference.")
+    return _READ_PREFERENCES[read_preference]
+
+
+def _index_spec(config):
+    # Returns {collection name: [(IndexModel, defer)]} for the INDEXES of a
+    # configuration. Each dot-separated part of the names in the spec that
+    # is a configuration key is replaced by its value.
+    def resolve(name):
+        return ".".join(config.get(part, part) for part in name.split("."))
+
+    spec = {}
+    for index in config["INDEXES"]:
+        model = IndexModel(
+            [(resolve(key), ASCENDING) for key in index["keys"]],
+            unique=index.get("unique", False),
+        )
+        spec.setdefault(resolve(index["collection"]), []).append(
+            (model, index.get("defer", False))
         )
-    next_id = __reserve_snp_ids(len(map_reader))
-    snp_ids = []
-    for snp in map_reader:
-        __adjust_snp(snp, map_reader)
-        if force_create_new:
-            snp_ids.append((next_id, True))
-            next_id += 1
-            continue
-        similar = __find_similar_snps(snp)
-        if len(similar) == 0:
-            snp_ids.append((next_id, True))
-            next_id += 1
-        elif len(similar) == 1 and force_use_existing:
-            snp_ids.append((similar[0]["_id"], False))
+    return spec
+
+
+def _hashed_key(value):
+    # Returns the value a MongoDB hashed index stores for a string or number:
+    # the first 8 bytes (a little-endian int64) of the MD5 of a zero seed,
+    # the canonical BSON type of the value and the value itself.
+    if isinstance(value, str):
+        data = value.encode() + b"\0"
+        element = struct.pack("<ii", 15, len(data)) + data
+    elif isinstance(value, (int, float)) and not isinstance(value, bool):
+        element = struct.pack("<iq", 10, int(value))
+    else:
+        raise Exception("Only strings and numbers can be hashed.")
+    digest = hashlib.md5(struct.pack("<i", 0) + element).digest()
+    return struct.unpack("<q", digest[:8])[0]
+
+
+def _shard_key_order(values):
+    # Sort key of shard key values following BSON order, for the types used
+    # in shard keys and chunk bounds here.
+    order = []
+    for value in values:
+        if isinstance(value, MinKey):
+            order.append((-1,))
+        elif isinstance(value, MaxKey):
+            order.append((127,))
+        elif isinstance(value, (int, float)):
+            order.append((10, value))
         else:
-            user_choice = __user_snp_choice(snp, similar, force_use_existing)
-            if user_choice is None:
-                return None
-            if user_choice in {"e", "E"}:
-                snp_ids.append((similar[0]["_id"], False))
-                force_use_existing = True
-            elif user_choice in {"0", "n", "N"}:
-                snp_ids.append((next_id, True))
-                next_id += 1
-                force_create_new = user_choice in {"n", "N"}
-            else:
-                snp_ids.append((similar[int(user_choice) - 1]["_id"], False))
-    return snp_ids
+            order.append((15, str(value)))
+    return tuple(order)
 
 
-def __user_individual_choice(tatoo, individuals):
+def _chunk_router(coll):
+    # Returns a function mapping a document of a collection to the chunk it
+    # would be stored in on a sharded cluster (its index among the chunks
+    # sorted by range), read once from the config database. The function
+    # returns None if the collection is not sharded (or the config database
+    # cannot be read), so batches grouped by chunk are simply not split.
+    config = coll.database.client["config"]
+    try:
+        sharding = config["collections"].find_one(
+            {"_id": coll.full_name, "dropped": {"$ne": True}}
+        )
+        if sharding is None:
+            return lambda doc: None
+        fields = list(sharding["key"].items())
+        chunks = config["chunks"].find(
+            {"$or": [{"ns": coll.full_name}, {"uuid": sharding.get("uuid")}]},
+            {"min": 1},
+        )
+        bounds = sorted(
+            _shard_key_order(chunk["min"][name] for name, _ in fields)
+            for chunk in chunks
+        )
+    except OperationFailure:
+        return lambda doc: None
+
+    def chunk(doc):
+        values = [
+            _hashed_key(doc[name]) if kind == "hashed" else doc[name]
+            for name, kind in fields
+        ]
+        return bisect.bisect_right(bounds, _shard_key_order(values)) - 1
+
+    return chunk
+
+
+def _user_individual_choice(tatoo, individuals):
     print("Ambigous match for individual %s:" % tatoo)
     i = 1
     for individual in individuals:
@@ -1287,9 +897,2907 @@ def __user_individual_choice(tatoo, individuals):
     return resp
 
 
-def __next_individual_id():
-    doc = _COUNTERS.find_one_and_update(
-        {"_id": _config["INDIVIDUALS_COLL"]},
-        {"$inc": {_config["COUNTERS_SEQ_VALUE_ATTR"]: 1}},
-    )
-    return doc[_config["COUNTERS_SEQ_VALUE_ATTR"]]
+# Names of the handles created by SnpDB.connect.
+_HANDLES = (
+    "_config",
+    "_client",
+    "_db",
+    "_snps",
+    "_maps",
+    "_inds",
+    "_snpblocks",
+    "_counters",
+    "_samples",
+    "_mapsnps",
+    "_summaries",
+    "_maintenance",
+    "_fastq_indexes",
+    "_gfs",
+)
+
+
+class SnpDB:
+    """Handle to a SNP database.
+
+    An instance owns its configuration, client and collection handles, so a
+    single process can work with several databases at once, e.g. workers on
+    different servers or isolated benchmark databases side by side. Nothing
+    is read or opened until the database is first used (or connect is
+    called). The module-level functions with the same names as the methods
+    below call them on a default instance (see default_db).
+    """
+
+    def __init__(
+        self,
+        config_path="config.js",
+        config=None,
+        client=None,
+        write_concern=None,
+        ordered=True,
+        read_preference=None,
+        map_cache_ttl=0,
+    ):
+        """Create a handle to the database described by a configuration.
+
+        Attributes
+        ----------
+        config_path="config.js"     Path to the configuration file (see
+                                    read_config).
+        config=None                 Configuration dict, used instead of
+                                    reading config_path.
+        client=None                 MongoClient used instead of creating one
+                                    for the configuration's HOST.
+        write_concern=None          Write concern of the writes made through
+                                    this handle: "unacknowledged",
+                                    "acknowledged", "journaled", "majority"
+                                    or a pymongo WriteConcern. If None, the
+                                    client's, which for clients created here
+                                    is the configuration's WRITE_CONCERN.
+        ordered=True                If False, the documents of bulk writes
+                                    (e.g. the samples and blocks of
+                                    import_samples) are sent unordered, so
+                                    the server may apply them in parallel and
+                                    goes on past failed documents.
+        read_preference=None        Members of the replica set the reads made
+                                    through this handle go to: "primary",
+                                    "primaryPreferred", "secondary",
+                                    "secondaryPreferred" or "nearest". If
+                                    None, the client's, which for clients
+                                    created here is the configuration's
+                                    READ_PREFERENCE. Reads from secondaries
+                                    take load off the primary, e.g. for
+                                    analyses and exports, but may not see the
+                                    latest writes.
+        map_cache_ttl=0             Seconds the documents and SNP lists of the
+                                    maps read by get_sample_data and
+                                    find_snp_of_sample are kept in memory, so
+                                    repeated calls skip those queries. Maps do
+                                    not change once imported, but one deleted
+                                    and imported again by another process is
+                                    only seen when its entry expires. If 0,
+                                    nothing is cached.
+        """
+        self._config_path = config_path
+        self.__config = config
+        self.__client = client
+        self.__write_concern = (
+            None if write_concern is None else _write_concern(write_concern)
+        )
+        self._ordered = ordered
+        self.__read_preference = (
+            None if read_preference is None else _read_preference(read_preference)
+        )
+        # Number of documents inserted through this handle, per collection.
+        self._inserted = Counter()
+        # Whether import_samples batches its inserts (handles of bulk_load).
+        self._batched = False
+        # Number of open import sessions, with the lock guarding it.
+        self.__sessions = Counter()
+        self.__sessions_lock = threading.Lock()
+        self.__map_cache_ttl = map_cache_ttl
+        self.__map_cache = {}
+        self.__lock = threading.Lock()
+
+    def __getattr__(self, name):
+        # The configuration and database handles are created on first use.
+        if name not in _HANDLES:
+            raise AttributeError(name)
+        self.connect()
+        return self.__dict__[name]
+
+    def connect(self):
+        """Read the configuration and connect, if not done yet.
+
+        Returns the database.
+        """
+        with self.__lock:
+            if "_db" not in self.__dict__:
+                config = self.__config
+                if config is None:
+                    config = read_config(self._config_path)
+                client = self.__client
+                if client is None:
+                    client = MongoClient(
+                        config["HOST"],
+                        readPreference=_read_preference(
+                            config["READ_PREFERENCE"]
+                        ).mongos_mode,
+                        **_write_concern(config["WRITE_CONCERN"]).document,
+                    )
+                db = client.get_database(
+                    config["DB_NAME"],
+                    write_concern=self.__write_concern,
+                    read_preference=self.__read_preference,
+                )
+                self._snps = db[config["SNPS_COLL"]]
+                self._maps = db[config["MAPS_COLL"]]
+                self._inds = db[config["INDIVIDUALS_COLL"]]
+                self._snpblocks = db[config["SNPBLOCKS_COLL"]]
+                self._counters = db[config["COUNTERS_COLL"]]
+                self._samples = db[config["SAMPLES_COLL"]]
+                self._mapsnps = db[config["MAPSNPS_COLL"]]
+                self._summaries = db[config["SUMMARIES_COLL"]]
+                self._maintenance = db[config["MAINTENANCE_COLL"]]
+                self._fastq_indexes = db[config["FASTQ_INDEXES_COLL"]]
+                self._gfs = GridFS(db)
+                # _db is set last, as it marks the handle as connected.
+                self._config, self._client, self._db = config, client, db
+        return self._db
+
+    def close(self):
+        """Close the client. It is reopened if the database is used again."""
+        with self.__lock:
+            if "_db" in self.__dict__:
+                self._client.close()
+                for name in _HANDLES:
+                    del self.__dict__[name]
+
+    def with_options(self, write_concern=None, ordered=None, read_preference=None):
+        """Return a handle to the same database with other options.
+
+        The new handle shares this one's configuration and client, its count
+        of inserted documents (see bulk_load), its import sessions (see
+        import_session) and its map cache (see map_cache_ttl on SnpDB).
+        Options left as None are the same as this handle's. For instance, a
+        session of analyses can read from secondaries with:
+
+            analytics = snpdb.default_db().with_options(
+                read_preference="secondaryPreferred"
+            )
+            analytics.get_sample_data(...)
+
+        Parameters
+        ----------
+        write_concern=None      Write concern of the writes made through the
+                                new handle (see SnpDB).
+        ordered=None            Whether bulk writes are ordered (see SnpDB).
+        read_preference=None    Read preference of the reads made through the
+                                new handle (see SnpDB).
+        """
+        other = SnpDB(
+            self._config_path,
+            self._config,
+            self._client,
+            write_concern=(
+                self.__write_concern if write_concern is None else write_concern
+            ),
+            ordered=self._ordered if ordered is None else ordered,
+            read_preference=(
+                self.__read_preference if read_preference is None else read_preference
+            ),
+            map_cache_ttl=self.__map_cache_ttl,
+        )
+        other._inserted = self._inserted
+        other._batched = self._batched
+        other.__sessions = self.__sessions
+        other.__sessions_lock = self.__sessions_lock
+        other.__map_cache = self.__map_cache
+        return other
+
+    @contextmanager
+    def bulk_load(
+        self, write_concern="unacknowledged", defer_indexes=True, verify=True
+    ):
+        """Context manager for fast loads of large amounts of data.
+
+        Yields a handle to the same database (see with_options) whose writes
+        use a relaxed write concern and unordered bulk inserts. Imports made
+        through it are much faster, at the cost of weaker guarantees: with
+        the default write concern, errors (e.g. duplicate samples) are not
+        reported and data may be lost if the server fails, so only use it
+        for loads that can be redone, such as the initial load of a fresh
+        database.
+
+            with snpdb.bulk_load() as db:
+                db.import_map(map_reader, "MAP")
+                db.import_samples(sample_reader, "MAP")
+
+        Parameters
+        ----------
+        write_concern="unacknowledged"  Write concern of the yielded handle.
+        defer_indexes=True              If True, the load runs in an import
+                                        session (see import_session), so the
+                                        indexes imports do not read are only
+                                        built on exit.
+        verify=True                     If True, on exit, the number of
+                                        documents added to each collection is
+                                        compared with the number inserted
+                                        through the yielded handle (or handles
+                                        derived from it), and an exception is
+                                        raised on mismatch. The counts come
+                                        from collection metadata, so documents
+                                        written or deleted by others during
+                                        the load make the check unreliable.
+        """
+        load = self.with_options(write_concern=write_concern, ordered=False)
+        load._batched = True
+        colls = [
+            self._maps,
+            self._mapsnps,
+            self._snps,
+            self._samples,
+            self._snpblocks,
+            self._inds,
+        ]
+        before = {c.name: c.estimated_document_count() for c in colls}
+        inserted_before = Counter(load._inserted)
+        if defer_indexes:
+            with load.import_session():
+                yield load
+        else:
+            yield load
+        if not verify:
+            return
+        inserted = load._inserted.copy()
+        inserted.subtract(inserted_before)
+        for attempt in range(_VERIFY_ATTEMPTS):
+            added = {
+                c.name: c.estimated_document_count() - before[c.name] for c in colls
+            }
+            missing = {
+                name: (added[name], n)
+                for name, n in inserted.items()
+                if n != 0 and added.get(name, n) != n
+            }
+            if len(missing) == 0:
+                return
+            if attempt < _VERIFY_ATTEMPTS - 1:
+                time.sleep(_VERIFY_INTERVAL)
+        raise Exception(
+            "Bulk load verification failed: "
+            + ", ".join(
+                f"{added} of {n} documents in {name}"
+                for name, (added, n) in missing.items()
+            )
+            + "."
+        )
+
+    def create_indexes(self, collections=None):
+        """Create the indexes of the configuration's INDEXES spec.
+
+        The spec is shared with mongo_setup.js. Indexes already in place are
+        left as they are. The indexes of different collections are built
+        concurrently, and those of each collection in a single pass.
+
+        Parameters
+        ----------
+        collections=None    Names of the collections whose indexes are
+                            created. If None, those of all collections.
+        """
+        spec = _index_spec(self._config)
+        if collections is not None:
+            spec = {name: spec[name] for name in collections if name in spec}
+        if len(spec) == 0:
+            return
+        with ThreadPoolExecutor(max_workers=len(spec)) as executor:
+            builds = [
+                executor.submit(
+                    self._db[name].create_indexes, [model for model, _ in indexes]
+                )
+                for name, indexes in spec.items()
+            ]
+            for build in builds:
+                build.result()
+
+    @contextmanager
+    def import_session(self, collections=None, report=False):
+        """Context manager deferring index builds during a series of imports.
+
+        On entry, the indexes marked with "defer" on the INDEXES spec (those
+        imports write but never query) are dropped. Any number of imports
+        can then run without updating them, and on exit all the indexes of
+        the spec are rebuilt at once (see create_indexes), even if an import
+        failed. Until then, queries using those indexes are slow and their
+        uniqueness is not enforced: rebuilding a unique index fails if
+        duplicates were imported. Nested sessions on the same handle (or
+        handles derived from it with with_options) only rebuild indexes when
+        the outermost one ends, and rebuild_indexes is ignored by imports
+        inside a session.
+
+            with snpdb.import_session():
+                for map_reader, sample_reader, name in files:
+                    snpdb.import_map(map_reader, name)
+                    snpdb.import_samples(sample_reader, name)
+
+        Parameters
+        ----------
+        collections=None    Names of the collections whose indexes are
+                            deferred. If None, those of all collections.
+        report=False        If True, the time taken to rebuild the indexes is
+                            printed.
+        """
+        with self.__sessions_lock:
+            self.__sessions["open"] += 1
+            outermost = self.__sessions["open"] == 1
+        try:
+            if outermost:
+                self.__drop_deferred_indexes(collections)
+            yield
+        finally:
+            with self.__sessions_lock:
+                self.__sessions["open"] -= 1
+            if outermost:
+                start = time.time()
+                self.create_indexes(collections)
+                if report:
+                    print(f"Indexes rebuilt in {time.time() - start:.3f} s.")
+
+    def delete_individuals(
+        self,
+        id=None,
+        tatoo=None,
+        sample_map=None,
+        sample_id=None,
+        chunk_size=1000,
+        dry_run=False,
+        report=False,
+    ) -> list:
+        """Search and delete all data from individuals in the database.
+
+        Returns a list with the status of the delete operations on the SNP
+        blocks, samples and individuals collections, in this order.
+
+        Deletes are grouped by map and issued with $in over at most chunk_size
+        sample (or individual) ids at a time, so each one uses the collections'
+        indexes and stays small no matter how many individuals are selected.
+
+        Parameters
+        ----------
+        id=None             Match only the individual with given internal id.
+        tatoo=None          Match only individuals which contain tatoo among
+                            their alternate IDs.
+        sample_map=None     Match only individuals that have data on the specified
+                            map.
+        sample_id=None      Match only individuals that have the specified sample
+                            id under some map.
+        chunk_size=1000     Maximum number of ids in each delete operation.
+        dry_run=False       If True, nothing is deleted, and the returned results
+                            hold the number of documents that would be deleted.
+        report=False        If True, progress is printed after each chunk.
+        """
+        # Only internal ids and sample keys are needed, so skip everything else.
+        samples_attr = self._config["INDIVIDUALS_SAMPLE_LIST_ATTR"]
+        individuals = self.iter_individuals(
+            id,
+            tatoo,
+            sample_map,
+            sample_id,
+            projection=[
+                "_id",
+                samples_attr + "." + self._config["SAMPLES_MAP_ATTR"],
+                samples_attr + "." + self._config["SAMPLES_ID_ATTR"],
+            ],
+        )
+        ind_ids: list = []
+        samples: dict = {}  # map name -> sample ids
+        for ind in individuals:
+            ind_ids.append(ind["_id"])
+            for s in ind.get(samples_attr, []):
+                samples.setdefault(s[self._config["SAMPLES_MAP_ATTR"]], []).append(
+                    s[self._config["SAMPLES_ID_ATTR"]]
+                )
+        if len(ind_ids) == 0:
+            return []
+
+        # Build the whole list of chunked operations before running any of them.
+        # Each operation is (collection, query, collection label).
+        operations: list = []
+        for map_name, sample_ids in samples.items():
+            for chunk in _chunks(sample_ids, chunk_size):
+                operations.append(
+                    (
+                        self._snpblocks,
+                        {
+                            self._config["SNPBLOCKS_MAP_ATTR"]: map_name,
+                            self._config["SNPBLOCKS_SAMPLE_ATTR"]: {"$in": chunk},
+                        },
+                        0,
+                    )
+                )
+                operations.append(
+                    (
+                        self._samples,
+                        {
+                            self._config["SAMPLES_MAP_ATTR"]: map_name,
+                            self._config["SAMPLES_ID_ATTR"]: {"$in": chunk},
+                        },
+                        1,
+                    )
+                )
+        for chunk in _chunks(ind_ids, chunk_size):
+            operations.append((self._inds, {"_id": {"$in": chunk}}, 2))
+            if self._config["SUMMARIES_ENABLED"] and not dry_run:
+                operations.append((self._summaries, {"_id": {"$in": chunk}}, None))
+
+        counts = [0, 0, 0]
+        for done, (coll, query, label) in enumerate(operations, 1):
+            if dry_run:
+                n = coll.count_documents(query)
+            else:
+                n = coll.delete_many(query).deleted_count
+            if label is not None:
+                counts[label] += n
+            if report:
+                print(
+                    f"{'Counted' if dry_run else 'Deleted'} {counts[0]} blocks, "
+                    + f"{counts[1]} samples, {counts[2]} individuals "
+                    + f"({done}/{len(operations)} operations)."
+                )
+        return [DeleteResult({"n": n, "ok": 1.0}, True) for n in counts]
+
+    def delete_map(self, name, chunk_size=1000, report=False):
+        """Delete a map and everything that depends on it.
+
+        Removes the map's samples and SNP blocks, unlinks those samples from
+        individuals, removes the map from its SNPs' map lists and deletes the
+        SNPs that are left without any map. Individuals themselves are kept.
+
+        The map document and its SNP lists are removed last, and every step
+        only touches what is still linked to the map, so the operation can be
+        safely re-run if it was interrupted.
+
+        Parameters
+        ----------
+        name                Name of the map to delete.
+        chunk_size=1000     Maximum number of blocks or SNPs in each delete.
+        report=False        If True, progress is printed after each step.
+        """
+        if len(self.find_maps(id=name)) == 0:
+            raise Exception("Map not found.")
+        SAMPLES = self._config["INDIVIDUALS_SAMPLE_LIST_ATTR"]
+        MAP = self._config["SAMPLES_MAP_ATTR"]
+        SNPS_MAPS = self._config["SNPS_MAPS_ATTR"]
+
+        # Unlink the map's samples from individuals.
+        n = self._inds.update_many(
+            {SAMPLES + "." + MAP: name}, {"$pull": {SAMPLES: {MAP: name}}}
+        ).modified_count
+        if self._config["SUMMARIES_ENABLED"]:
+            self._summaries.update_many(
+                {"maps.map": name},
+                {"$pull": {"samples": {"map": name}, "maps": {"map": name}}},
+            )
+        if report:
+            print(f"{n} individuals unlinked from map {name}.")
+
+        # Delete blocks chunk_size at a time (including those left behind by a
+        # partial import), then the samples themselves.
+        n = 0
+        while True:
+            ids = [
+                block["_id"]
+                for block in self._snpblocks.find(
+                    {self._config["SNPBLOCKS_MAP_ATTR"]: name},
+                    {"_id": 1},
+                    limit=chunk_size,
+                )
+            ]
+            if len(ids) == 0:
+                break
+            n += self._snpblocks.delete_many({"_id": {"$in": ids}}).deleted_count
+        m = self._samples.delete_many({MAP: name}).deleted_count
+        if report:
+            print(f"{m} samples and {n} blocks deleted.")
+
+        # Remove the map from its SNPs, one SNP list document at a time.
+        pulled, deleted = 0, 0
+        for part in self._mapsnps.find(
+            {self._config["MAPSNPS_MAP_ATTR"]: name},
+            {self._config["MAPSNPS_LIST_ATTR"]: 1},
+        ):
+            ids = part[self._config["MAPSNPS_LIST_ATTR"]]
+            pulled += self._snps.update_many(
+                {"_id": {"$in": ids}, SNPS_MAPS: name}, {"$pull": {SNPS_MAPS: name}}
+            ).modified_count
+            deleted += self._snps.delete_many(
+                {"_id": {"$in": ids}, SNPS_MAPS: []}
+            ).deleted_count
+        # Catch SNPs whose map list wasn't stored (e.g. interrupted import_map).
+        while True:
+            ids = [
+                snp["_id"]
+                for snp in self._snps.find(
+                    {SNPS_MAPS: name}, {"_id": 1}, limit=chunk_size
+                )
+            ]
+            if len(ids) == 0:
+                break
+            pulled += self._snps.update_many(
+                {"_id": {"$in": ids}, SNPS_MAPS: name}, {"$pull": {SNPS_MAPS: name}}
+            ).modified_count
+            deleted += self._snps.delete_many(
+                {"_id": {"$in": ids}, SNPS_MAPS: []}
+            ).deleted_count
+        if report:
+            print(f"Map removed from {pulled} SNPs, {deleted} orphan SNPs deleted.")
+
+        self._mapsnps.delete_many({self._config["MAPSNPS_MAP_ATTR"]: name})
+        self._maps.delete_one({"_id": name})
+        self.__map_cache.pop(name, None)
+        if report:
+            print(f"Map {name} deleted.")
+
+    def find_snp(
+        self,
+        id=None,
+        min_chrom=None,
+        max_chrom=None,
+        min_pos=None,
+        max_pos=None,
+        map=None,
+        iid=None,
+        chr=None,
+    ):
+        """Search SNPs in the database.
+
+        Returns a list of dicts, each representing a SNP.
+
+        Parameters
+        ----------
+        id=None          Match only SNPs with given name.
+        min_chrom=None   Match only SNPs with a chromosome that compares greater
+                         or equal to the one given.
+        max_chrom=None   Match only SNPs with a chromosome that compares lesser
+                         or equal to the one given.
+        min_pos=None     Match only SNPs with a position value that compares
+                         greater or equal than the one given.
+        max_pos=None     Match only SNPs with a position value that compares
+                         smaller or equal than the one given.
+        map=None         Match only SNPs that are contained within the map given.
+        iid=None         Match only the SNP with the given internal numeric id.
+        chr=None         Match only the SNPs with the given chromosome.
+        """
+        return list(
+            self.iter_snp(id, min_chrom, max_chrom, min_pos, max_pos, map, iid, chr)
+        )
+
+    def iter_snp(
+        self,
+        id=None,
+        min_chrom=None,
+        max_chrom=None,
+        min_pos=None,
+        max_pos=None,
+        map=None,
+        iid=None,
+        chr=None,
+        batch_size=None,
+        limit=None,
+        skip=None,
+        after=None,
+        projection=None,
+    ):
+        """Search SNPs in the database.
+
+        Same as find_snp, but returns an iterator over the matching SNPs instead
+        of a list, so results can be consumed as they arrive from the server.
+
+        Parameters
+        ----------
+        id=None          Match only SNPs with given name.
+        min_chrom=None   Match only SNPs with a chromosome that compares greater
+                         or equal to the one given.
+        max_chrom=None   Match only SNPs with a chromosome that compares lesser
+                         or equal to the one given.
+        min_pos=None     Match only SNPs with a position value that compares
+                         greater or equal than the one given.
+        max_pos=None     Match only SNPs with a position value that compares
+                         smaller or equal than the one given.
+        map=None         Match only SNPs that are contained within the map given.
+        iid=None         Match only the SNP with the given internal numeric id.
+        chr=None         Match only the SNPs with the given chromosome.
+        batch_size=None  Number of documents fetched per round trip.
+        limit=None       Return at most this many documents.
+        skip=None        Skip this many documents (ordered by internal id).
+        after=None       Range-key pagination: return only documents whose
+                         internal id is greater than this one, in id order.
+                         Pass the last id seen to fetch the next page.
+        projection=None  Fields to return, as accepted by MongoDB's find.
+        """
+        chrom = self._config["SNPS_CHROMOSOME_ATTR"]
+        pos = self._config["SNPS_POSITION_ATTR"]
+        name = self._config["SNPS_NAME_ATTR"]
+        mp = self._config["SNPS_MAPS_ATTR"]
+        query, chrom_query, pos_query = {}, {}, {}
+
+        if min_chrom is not None:
+            chrom_query.update({"$gte": min_chrom})
+        if max_chrom is not None:
+            chrom_query.update({"$lte": max_chrom})
+        if chr is not None:
+            try:
+                chrom_query.update({"$eq": int(chr)})
+            except ValueError:
+                chrom_query.update({"$eq": chr})
+        if min_pos is not None:
+            pos_query.update({"$gte": min_pos})
+        if max_pos is not None:
+            pos_query.update({"$lte": max_pos})
+
+        if id is not None:
+            query.update({name: id})
+        if map is not None:
+            query.update({mp: map})
+        if iid is not None:
+            query.update({"_id": iid})
+        if len(chrom_query) > 0:
+            query.update({chrom: chrom_query})
+        if len(pos_query) > 0:
+            query.update({pos: pos_query})
+        return _paged_find(
+            self._snps, query, projection, batch_size, limit, skip, after
+        )
+
+    def find_maps(self, id=None, min_size=None, max_size=None, format=None):
+        """Search maps in the database.
+
+        Returns a list of dicts, each representing a map.
+
+        Parameters
+        ----------
+        id=None          Match only maps with given name.
+        min_size=None    Match only maps with size at least min_size.
+        max_size=None    Match only maps with size at most map_size.
+        format=None      Match only maps with the specified format identifier.
+        """
+        return list(self.iter_maps(id, min_size, max_size, format))
+
+    def iter_maps(
+        self,
+        id=None,
+        min_size=None,
+        max_size=None,
+        format=None,
+        batch_size=None,
+        limit=None,
+        skip=None,
+        after=None,
+        projection=None,
+    ):
+        """Search maps in the database.
+
+        Same as find_maps, but returns an iterator over the matching maps.
+
+        Parameters
+        ----------
+        id=None          Match only maps with given name.
+        min_size=None    Match only maps with size at least min_size.
+        max_size=None    Match only maps with size at most map_size.
+        format=None      Match only maps with the specified format identifier.
+        batch_size=None  Number of documents fetched per round trip.
+        limit=None       Return at most this many documents.
+        skip=None        Skip this many documents (ordered by internal id).
+        after=None       Range-key pagination: return only documents whose
+                         internal id is greater than this one, in id order.
+                         Pass the last id seen to fetch the next page.
+        projection=None  Fields to return, as accepted by MongoDB's find.
+                         By default, only format, size and block size are
+                         returned.
+        """
+        query = {}
+        size_query = {}
+        if id is not None:
+            query.update({"_id": id})
+        if format is not None:
+            query.update({self._config["MAPS_FORMAT_ATTR"]: format})
+        if min_size is not None:
+            size_query.update({"$gte": min_size})
+        if max_size is not None:
+            size_query.update({"$lte": max_size})
+        if len(size_query) > 0:
+            query.update({self._config["MAPS_SIZE_ATTR"]: size_query})
+        if projection is None:
+            projection = {
+                self._config["MAPS_FORMAT_ATTR"]: 1,
+                self._config["MAPS_SIZE_ATTR"]: 1,
+                self._config["MAPS_BLOCK_SIZE_ATTR"]: 1,
+            }
+        return _paged_find(
+            self._maps, query, projection, batch_size, limit, skip, after
+        )
+
+    def get_map_snps(self, id):
+        """Retrive the SNPs a map contains in the form of list of internal IDs.
+
+        A tuple of two lists is returned, first one with the IDs sorted in the
+        map's original import order, and the second sorted by id value.
+
+        Parameters
+        ----------
+        id      The map's id.
+        """
+        cur = self._mapsnps.find(
+            {self._config["MAPSNPS_MAP_ATTR"]: id},
+            sort=[(self._config["MAPSNPS_IDX_ATTR"], 1)],
+        )
+        snps, ssnps = [], []
+        for doc in cur:
+            snps.extend(doc[self._config["MAPSNPS_LIST_ATTR"]])
+            ssnps.extend(doc[self._config["MAPSNPS_SORTED_LIST_ATTR"]])
+        return snps, ssnps
+
+    def find_individuals(
+        self, id=None, tatoo=None, sample_map=None, sample_id=None, projection=None
+    ):
+        """Search individuals in the database.
+
+        Returns a list of dicts, one for each individual in the result.
+
+        Parameters
+        ----------
+        id=None             Match only the individual with given internal id.
+        tatoo=None          Match only individuals which contain tatoo among
+                            their alternate IDs.
+        sample_map=None     Match only individuals that have data on specified map.
+        sample_id=None      Match only individuals that have the specified sample
+                            under some map.
+        projection=None     Fields to return, as accepted by MongoDB's find
+                            (e.g. ["tatoos"]). Individuals may be linked to many
+                            samples, so leaving out the sample list when it's not
+                            needed saves a lot of transfer.
+        """
+        return list(
+            self.iter_individuals(
+                id, tatoo, sample_map, sample_id, projection=projection
+            )
+        )
+
+    def iter_individuals(
+        self,
+        id=None,
+        tatoo=None,
+        sample_map=None,
+        sample_id=None,
+        batch_size=None,
+        limit=None,
+        skip=None,
+        after=None,
+        projection=None,
+    ):
+        """Search individuals in the database.
+
+        Same as find_individuals, but returns an iterator over the matching
+        individuals.
+
+        Parameters
+        ----------
+        id=None             Match only the individual with given internal id.
+        tatoo=None          Match only individuals which contain tatoo among
+                            their alternate IDs.
+        sample_map=None     Match only individuals that have data on specified map.
+        sample_id=None      Match only individuals that have the specified sample
+                            under some map.
+        batch_size=None     Number of documents fetched per round trip.
+        limit=None          Return at most this many documents.
+        skip=None           Skip this many documents (ordered by internal id).
+        after=None          Range-key pagination: return only documents whose
+                            internal id is greater than this one, in id order.
+                            Pass the last id seen to fetch the next page.
+        projection=None     Fields to return, as accepted by MongoDB's find.
+        """
+        query = {}
+        if id is not None:
+            query.update({"_id": id})
+        if tatoo is not None:
+            query.update({self._config["INDIVIDUALS_ID_LIST_ATTR"]: tatoo})
+        if sample_map is not None:
+            attr = (
+                self._config["INDIVIDUALS_SAMPLE_LIST_ATTR"]
+                + "."
+                + self._config["SAMPLES_MAP_ATTR"]
+            )
+            query.update({attr: sample_map})
+        if sample_id is not None:
+            attr = (
+                self._config["INDIVIDUALS_SAMPLE_LIST_ATTR"]
+                + "."
+                + self._config["SAMPLES_ID_ATTR"]
+            )
+            query.update({attr: sample_id})
+        return _paged_find(
+            self._inds, query, projection, batch_size, limit, skip, after
+        )
+
+    def find_individuals_of_snps(
+        self,
+        id=None,
+        min_chrom=None,
+        max_chrom=None,
+        min_pos=None,
+        max_pos=None,
+        map=None,
+        iid=None,
+        chr=None,
+        projection=None,
+    ) -> list:
+        """Search individuals in the database, using a list of SNPs.
+
+        Returns a list of dicts, one for each individual in the result.
+
+        Parameters
+        ----------
+        id=None          Match only SNPs with given name.
+        min_chrom=None   Match only SNPs with a chromosome that compares greater
+                         or equal to the one given.
+        max_chrom=None   Match only SNPs with a chromosome that compares lesser
+                         or equal to the one given.
+        min_pos=None     Match only SNPs with a position value that compares
+                         greater or equal than the one given.
+        max_pos=None     Match only SNPs with a position value that compares
+                         smaller or equal than the one given.
+        map=None         Match only SNPs that are contained within the map given.
+        iid=None         Match only the SNP with the given internal numeric id.
+        chr=None         Match only the SNPs with the given chromosome.
+        projection=None  Fields of the individuals to return, as accepted by
+                         MongoDB's find (see find_individuals).
+        """
+        snps = self.iter_snp(
+            id,
+            min_chrom,
+            max_chrom,
+            min_pos,
+            max_pos,
+            map,
+            iid,
+            chr,
+            projection=[self._config["SNPS_MAPS_ATTR"]],
+        )
+        # _SNPS -> _MAPS -> _SAMPLES -> _INDS
+        # Find maps of given SNPs
+        maps: list = list(
+            set(
+                [
+                    map
+                    for maps in [snp[self._config["SNPS_MAPS_ATTR"]] for snp in snps]
+                    for map in maps
+                ]
+            )
+        )
+        # Find samples of associated maps
+        if len(maps) == 0:
+            return []  # No associated maps -> no associated individuals
+        query_samples: dict = {
+            "$or": [{self._config["SAMPLES_MAP_ATTR"]: map} for map in maps]
+        }
+        samples: list = list(
+            self._samples.find(
+                query_samples,
+                {
+                    "_id": 0,
+                    self._config["SAMPLES_MAP_ATTR"]: 1,
+                    self._config["SAMPLES_ID_ATTR"]: 1,
+                },
+            )
+        )
+        if len(samples) == 0:
+            return []
+        # Find individuals of associated samples
+        map_attr: str = str(
+            self._config["INDIVIDUALS_SAMPLE_LIST_ATTR"]
+            + "."
+            + self._config["SAMPLES_MAP_ATTR"]
+        )
+        id_attr: str = str(
+            self._config["INDIVIDUALS_SAMPLE_LIST_ATTR"]
+            + "."
+            + self._config["SAMPLES_ID_ATTR"]
+        )
+        query_individuals: dict = {
+            "$or": [
+                {
+                    map_attr: sample[self._config["SAMPLES_MAP_ATTR"]],
+                    id_attr: sample[self._config["SAMPLES_ID_ATTR"]],
+                }
+                for sample in samples
+            ]
+        }
+        return list(self._inds.find(query_individuals, projection))
+
+    def find_snp_of_sample(self, mapname, sample, snp_id, keys=None):
+        """Fetch SNP data of a given sample from a given map.
+
+        Returns a dict with all data available.
+        Parameters
+        ----------
+        mapname     Map to use.
+        sample      Sample id within map.
+        snp_id      Internal id of the SNP to fetch.
+        keys=None   List of genotype keys to fetch (e.g. ["gc"]). If None, all
+                    keys are fetched.
+        """
+        GEN = self._config["SNPBLOCKS_GENOTYPE"]
+        BLOCK_SIZE = self._config["MAPS_BLOCK_SIZE_ATTR"]
+        SORTED_SNPS = self._config["MAPSNPS_SORTED_LIST_ATTR"]
+        IDX = self._config["MAPSNPS_IDX_ATTR"]
+        MAX_LIST_SIZE = self._config["MAPSNPS_MAX_LIST_SIZE"]
+        MAP = self._config["MAPSNPS_MAP_ATTR"]
+        try:
+            cached = self.__cached_map(mapname)
+            if cached is not None:
+                map, _, sorted_snps = cached
+                index = bisect.bisect_left(sorted_snps, snp_id)
+                if sorted_snps[index] != snp_id:
+                    return None
+            else:
+                map = self.find_maps(id=mapname)[0]
+                pipeline = [
+                    {"$match": {MAP: mapname}},
+                    {
+                        "$project": {
+                            "idx": {"$indexOfArray": ["$" + SORTED_SNPS, snp_id]},
+                            IDX: 1,
+                        }
+                    },
+                ]
+                for part in self._mapsnps.aggregate(pipeline):
+                    if part["idx"] != -1:
+                        index = part["idx"] + part[IDX] * MAX_LIST_SIZE
+                        break
+            blk = index // map[BLOCK_SIZE]
+            pos = index % map[BLOCK_SIZE]
+
+            block = self._snpblocks.find_one(
+                {
+                    self._config["SNPBLOCKS_MAP_ATTR"]: mapname,
+                    self._config["SNPBLOCKS_BLOCK_NUMBER"]: blk,
+                    self._config["SNPBLOCKS_SAMPLE_ATTR"]: sample,
+                },
+                self.__genotype_projection(keys),
+            )
+
+        except (IndexError, ValueError, UnboundLocalError):
+            return None
+
+        if block is None:
+            return None
+        res = {}
+        for key in block[GEN]:
+            if block[GEN][key][0] == " ":
+                res[key] = block[GEN][key].split()[pos]
+            else:
+                res[key] = block[GEN][key][pos]
+        return res
+
+    def find_sample(self, id=None, map=None):
+        """Search samples in the database.
+
+        Parameters
+        ----------
+        id=None     Match samples with the specified within-map id for some map.
+        map=None    Match samples which contain data under the specified map.
+        """
+        return list(self.iter_sample(id, map))
+
+    def iter_sample(
+        self,
+        id=None,
+        map=None,
+        batch_size=None,
+        limit=None,
+        skip=None,
+        after=None,
+        projection=None,
+    ):
+        """Search samples in the database, returning an iterator over the matches.
+
+        Parameters
+        ----------
+        id=None             Match samples with the specified within-map id for
+                            some map.
+        map=None            Match samples which contain data under the specified
+                            map.
+        batch_size=None     Number of documents fetched per round trip.
+        limit=None          Return at most this many documents.
+        skip=None           Skip this many documents (ordered by internal id).
+        after=None          Range-key pagination: return only documents whose
+                            internal id is greater than this one, in id order.
+                            Pass the last id seen to fetch the next page.
+        projection=None     Fields to return, as accepted by MongoDB's find.
+        """
+        query = {}
+        if id is not None:
+            query[self._config["SAMPLES_ID_ATTR"]] = id
+        if map is not None:
+            query[self._config["SAMPLES_MAP_ATTR"]] = map
+        return _paged_find(
+            self._samples, query, projection, batch_size, limit, skip, after
+        )
+
+    def get_sample_data(
+        self, id, map, as_array=False, snps=None, keys=None, read_preference=None
+    ):
+        """Retrive sample data.
+
+        The data is returned as a dict, following the same format produced by
+        the SampleWriter used to import it.
+
+        Parameters
+        ----------
+        id                  The sample within-map id.
+        map                 The sample's associated map.
+        as_array=False      If True, each genotype key is returned as a NumPy
+                            array decoded directly from the stored blocks:
+                            uint8 character codes for genotypes stored as
+                            strings and other single-character values,
+                            float32 for numeric values of any width (even
+                            single digits stored as lists) and fixed-width
+                            bytes for anything else. Much cheaper than the
+                            default lists of strings for large maps.
+        snps=None           List of internal SNP ids. If given, only the blocks
+                            containing these SNPs are fetched, and each genotype
+                            key holds their values in the same order as snps.
+        keys=None           List of genotype keys to fetch (e.g. ["a1ab", "a2ab"]).
+                            Other keys are neither transferred nor decoded.
+                            If None, all keys are returned.
+        read_preference=None
+                            Read preference of the call (see SnpDB), e.g.
+                            "secondaryPreferred". If None, this handle's.
+        """
+        if read_preference is not None:
+            return self.with_options(read_preference=read_preference).get_sample_data(
+                id, map, as_array=as_array, snps=snps, keys=keys
+            )
+        samples = self.find_sample(id, map)
+        if len(samples) > 1:
+            raise Exception("Homonymous samples within the same map.")
+        if len(samples) == 0:
+            return None
+        # sample = samples[0]
+
+        try:
+            cached = self.__cached_map(map)
+        except IndexError:
+            raise Exception("Sample map data is missing.") from None
+        if cached is not None:
+            m, map_snps, sorted_snps = cached
+        else:
+            maps = self.find_maps(id=map)
+            if len(maps) == 0:
+                raise Exception("Sample map data is missing.")
+            if len(maps) > 1:
+                raise Exception("Homonymous maps with the same ID.")
+            m = maps[0]
+            map_snps, sorted_snps = self.get_map_snps(map)
+
+        GEN = self._config["SNPBLOCKS_GENOTYPE"]
+        SNPBLOCKS_MAP = self._config["SNPBLOCKS_MAP_ATTR"]
+        SNPBLOCKS_SAMPLE = self._config["SNPBLOCKS_SAMPLE_ATTR"]
+        SNPBLOCKS_NO = self._config["SNPBLOCKS_BLOCK_NUMBER"]
+        query = {SNPBLOCKS_MAP: map, SNPBLOCKS_SAMPLE: id}
+
+        if snps is not None:
+            # Locate each requested SNP within the id-sorted block layout and
+            # fetch only the blocks that contain at least one of them.
+            bsize = m[self._config["MAPS_BLOCK_SIZE_ATTR"]]
+            sorted_snps = np.asarray(sorted_snps)
+            pos = np.searchsorted(sorted_snps, snps)
+            if len(sorted_snps) == 0 or (pos >= len(sorted_snps)).any():
+                raise Exception("SNP not found in map.")
+            if (sorted_snps[pos] != snps).any():
+                raise Exception("SNP not found in map.")
+            blk_nos = np.unique(pos // bsize)
+            query[SNPBLOCKS_NO] = {"$in": blk_nos.tolist()}
+            # Blocks are concatenated in order, and only the map's last block
+            # may be shorter than bsize, so fetched block k starts at k * bsize.
+            idx = np.searchsorted(blk_nos, pos // bsize) * bsize + pos % bsize
+
+        blocks = self._snpblocks.find(
+            query, self.__genotype_projection(keys), sort=[(SNPBLOCKS_NO, 1)]
+        )
+
+        if snps is not None:
+            chunks = {}
+            for block in blocks:
+                g = block[GEN]
+                for key in g:
+                    chunks.setdefault(key, []).append(g[key])
+            genotype = {}
+            for key in chunks:
+                if as_array:
+                    genotype[key] = _decode_genotype_array(chunks[key])[idx]
+                else:
+                    data = _decode_genotype_list(chunks[key])
+                    genotype[key] = [data[i] for i in idx]
+            return genotype
+
+        if as_array:
+            chunks = {}
+            for block in blocks:
+                g = block[GEN]
+                for key in g:
+                    chunks.setdefault(key, []).append(g[key])
+            order = np.argsort(np.asarray(map_snps), kind="stable")
+            genotype = {}
+            for key in chunks:
+                data = _decode_genotype_array(chunks[key])
+                if len(data) != m[self._config["MAPS_SIZE_ATTR"]]:
+                    raise Exception("Sample genotype and map size mismatch.")
+                genotype[key] = np.empty_like(data)
+                genotype[key][order] = data
+            return genotype
+
+        genotype = {}
+        for block in blocks:
+            g = block[GEN]
+            for key in g:
+                if g[key][0] == " ":
+                    data = g[key].split()
+                else:
+                    data = list(g[key])
+                if key not in genotype:
+                    genotype[key] = []
+                genotype[key].extend(data)
+
+        where = {}
+        for i, snp_id in enumerate(map_snps):
+            where[snp_id] = i
+
+        perm = [where[snp_id] for snp_id in sorted_snps]
+
+        for key in genotype:
+            if len(genotype[key]) != m[self._config["MAPS_SIZE_ATTR"]]:
+                raise Exception("Sample genotype and map size mismatch.")
+            genotype[key] = [x for _, x in sorted(zip(perm, genotype[key]))]
+
+        return genotype
+
+    def insert_file(
+        self, file, dedup=False, codec=None, fastq_index=None, analyze=False, **kwargs
+    ):
+        """Upload a file to the database, optionally linking it to an individual.
+
+        The SHA-256 hash of the contents is computed while uploading and stored
+        in the file's metadata. Returns the id of the new file.
+
+        If a codec is given, the contents are compressed in independent frames
+        of FILES_FRAME_SIZE bytes, and the codec, the uncompressed size and an
+        index of the frames are stored in the file's metadata. Compressed files
+        are decompressed transparently by get_files, read_file_range and
+        open_file.
+
+        If analyze is True, the analyzer registered for the file's extension
+        (see register_analyzer) runs on a worker thread over the same pieces of
+        the file that are uploaded, and its results are stored in the file's
+        metadata under FILES_STATS_ATTR. If the analysis fails (e.g. on a
+        truncated FASTQ record), the file is stored anyway, and the error is
+        recorded there as {"error": message} instead.
+
+        Parameters
+        ----------
+        file                    File-like object to import
+        dedup=False             If True and a file with the same contents is
+                                already stored, only a new metadata document
+                                pointing to the existing contents is written.
+                                Seekable files are hashed before uploading, so
+                                duplicates aren't transferred at all.
+        codec=None              Compress the contents with "gzip" or "zstd" (the
+                                latter requires the zstandard package).
+        fastq_index=None        If given and the file is a FASTQ file (its
+                                extension is registered to FastqIndexer, see
+                                register_analyzer), it is parsed while
+                                uploading, and the offset of one of every
+                                fastq_index records is stored with statistics
+                                about the reads (see get_fastq_index). Files
+                                deduplicated before uploading share the index
+                                of the existing contents, if any. Implies
+                                analyze for FASTQ files; other files are
+                                stored as usual.
+        analyze=False           Compute statistics about the file while uploading
+                                it. Files deduplicated before uploading share
+                                the statistics of the existing contents.
+        **kwargs                (optional) Metadata below may be passed as kwargs
+        individual_id           Identifier of the individual associated with the
+                                the file. It has no special meaning, except for the
+                                summarize method, which considers that a file is
+                                associated with an individual iif this value is
+                                equal to its internal id.
+        file_type               Type of inserted file (FastQ, Image, etc)
+        description             Description of the inserted file
+        """
+        filename = os.path.basename(file.name)
+        analyzer = None
+        analyzer_class = _ANALYZERS.get(os.path.splitext(filename)[1].lower())
+        if fastq_index is not None and analyzer_class is not None:
+            if issubclass(analyzer_class, FastqIndexer):
+                analyzer = analyzer_class(fastq_index)
+            elif analyze:
+                analyzer = analyzer_class()
+        elif analyze and analyzer_class is not None:
+            analyzer = analyzer_class()
+        file_id = self.__put_file(file, filename, kwargs, dedup, codec, analyzer)
+        FILE_IND = self._config["FILES_INDIVIDUAL_ATTR"]
+        if self._config["SUMMARIES_ENABLED"] and FILE_IND in kwargs:
+            self._summaries.update_one(
+                {"_id": kwargs[FILE_IND]},
+                {
+                    "$push": {
+                        "files": {
+                            "_id": file_id,
+                            "filename": filename,
+                            "type": kwargs.get(self._config["FILES_TYPE"]),
+                        }
+                    }
+                },
+                upsert=True,
+            )
+        return file_id
+
+    def insert_files(
+        self,
+        paths,
+        manifest=None,
+        workers=4,
+        report=False,
+        dedup=False,
+        codec=None,
+        fastq_index=None,
+        analyze=False,
+        **kwargs,
+    ):
+        """Upload many files to the database in parallel.
+
+        Files are uploaded with insert_file on a pool of worker threads, which
+        share the client's connection pool. Returns the ids of the uploaded
+        files, in the same order as paths.
+
+        Parameters
+        ----------
+        paths           List of paths of the files to upload. Directories are
+                        expanded recursively to the files they contain.
+        manifest=None   Dict mapping file names (or paths) to dicts of metadata
+                        for that file, which are added to kwargs (see
+                        insert_file).
+        workers=4       Number of files uploaded at the same time.
+        report=False    If True, the number of files and the throughput are
+                        printed when finished.
+        dedup=False     Store duplicated contents only once (see insert_file).
+        codec=None      Compress the contents with this codec (see insert_file).
+        fastq_index=None
+                        Index FASTQ files while uploading (see insert_file).
+        analyze=False   Compute statistics about the files while uploading
+                        (see insert_file).
+        **kwargs        Metadata common to all files (see insert_file).
+        """
+        files = []
+        for path in paths:
+            if os.path.isdir(path):
+                for root, _, names in os.walk(path):
+                    files.extend(os.path.join(root, name) for name in sorted(names))
+            else:
+                files.append(path)
+        if manifest is None:
+            manifest = {}
+
+        def upload(path):
+            metadata = dict(kwargs)
+            metadata.update(manifest.get(os.path.basename(path), {}))
+            metadata.update(manifest.get(path, {}))
+            with open(path, "rb") as f:
+                return self.insert_file(
+                    f,
+                    dedup=dedup,
+                    codec=codec,
+                    fastq_index=fastq_index,
+                    analyze=analyze,
+                    **metadata,
+                )
+
+        start = time.time()
+        if workers > 1:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                file_ids = list(executor.map(upload, files))
+        else:
+            file_ids = [upload(path) for path in files]
+        if report:
+            elapsed = time.time() - start
+            size = sum(os.path.getsize(path) for path in files) / 2**20
+            print(
+                f"{len(files)} files ({size:.1f} MiB) uploaded in {elapsed:.3f} s "
+                + f"({len(files) / max(elapsed, 1e-9):.1f} files/s, "
+                + f"{size / max(elapsed, 1e-9):.1f} MiB/s)."
+            )
+        return file_ids
+
+    def delete_files(self, files):
+        """Delete a list of files from the database.
+
+        Contents shared by deduplicated uploads (see insert_file) are reference
+        counted, and only removed once no file points to them anymore.
+
+        Parameters
+        ----------
+        files   List of dicts describing the files to delete, such as the one
+                returned by list_files. Each dict must contain the "_id" field
+                of the file to delete.
+        """
+        REFS = "metadata." + self._config["FILES_REFS_ATTR"]
+        DELETED = "metadata." + self._config["FILES_DELETED_ATTR"]
+        for file_doc in files:
+            doc = self._db.fs.files.find_one({"_id": file_doc["_id"]}, {"metadata": 1})
+            if doc is None:
+                continue
+            content_id = doc.get("metadata", {}).get(self._config["FILES_CONTENT_ATTR"])
+            if content_id is not None:
+                # A link: drop it, and the contents too if it was the last one
+                # and the contents' own file was already deleted.
+                self._db.fs.files.delete_one({"_id": doc["_id"]})
+                content = self._db.fs.files.find_one_and_update(
+                    {"_id": content_id},
+                    {"$inc": {REFS: -1}},
+                    projection={"metadata": 1},
+                    return_document=ReturnDocument.AFTER,
+                )
+                metadata = {} if content is None else content.get("metadata", {})
+                if (
+                    metadata.get(self._config["FILES_DELETED_ATTR"])
+                    and metadata.get(self._config["FILES_REFS_ATTR"], 0) <= 0
+                ):
+                    self.__delete_contents(content_id)
+            elif (
+                self._db.fs.files.find_one_and_update(
+                    {"_id": doc["_id"], REFS: {"$gt": 0}}, {"$set": {DELETED: True}}
+                )
+                is None
+            ):
+                self.__delete_contents(doc["_id"])
+            # Otherwise, links still use the contents, which stay hidden.
+            if self._config["SUMMARIES_ENABLED"]:
+                self._summaries.update_many(
+                    {"files._id": doc["_id"]}, {"$pull": {"files": {"_id": doc["_id"]}}}
+                )
+
+    def list_files(self, projection=None, **kwargs):
+        """Search files in the database.
+
+        Returns a list of dicts, each one containing metadata from
+        a file.
+
+        Parameters
+        ----------
+        **kwargs                (optional) Metadata below may be passed as kwargs
+        individual_id           Match only files with the specified individual_id.
+        filename                Match only files with the specified filename
+        file_type               Match only files with the specified file type.
+        description             Match only files with the specified description.
+        projection=None         Fields to return (see iter_files).
+        """
+        return list(self.iter_files(projection=projection, **kwargs))
+
+    def list_files_for_individuals(self, ids, projection=None, **kwargs):
+        """Search the files of many individuals in a single query.
+
+        Returns a dict mapping each id in ids to the list of files associated
+        with that individual (empty if there are none).
+
+        Parameters
+        ----------
+        ids                     List of individual ids (see insert_file).
+        projection=None         Fields to return (see iter_files). The
+                                individual id is always returned.
+        **kwargs                (optional) Other filters accepted by list_files.
+        """
+        FILE_IND = self._config["FILES_INDIVIDUAL_ATTR"]
+        if projection is not None:
+            projection = _with_field(projection, "metadata." + FILE_IND)
+        files: dict = {id: [] for id in ids}
+        for f in self.iter_files(
+            individual_id={"$in": list(files)}, projection=projection, **kwargs
+        ):
+            files[f["metadata"][FILE_IND]].append(f)
+        return files
+
+    def iter_files(
+        self,
+        batch_size=None,
+        limit=None,
+        skip=None,
+        after=None,
+        projection=None,
+        **kwargs,
+    ):
+        """Search files in the database.
+
+        Same as list_files, but returns an iterator over the matching files.
+
+        Parameters
+        ----------
+        **kwargs                (optional) Metadata below may be passed as kwargs
+        individual_id           Match only files with the specified individual_id.
+        filename                Match only files with the specified filename
+        file_type               Match only files with the specified file type.
+        description             Match only files with the specified description.
+        batch_size=None         Number of documents fetched per round trip.
+        limit=None              Return at most this many documents.
+        skip=None               Skip this many documents (ordered by internal id).
+        after=None              Range-key pagination: return only documents whose
+                                internal id is greater than this one, in id order.
+                                Pass the last id seen to fetch the next page.
+        projection=None         Fields to return, as accepted by MongoDB's find.
+                                By default, everything but chunkSize and the
+                                frame index of compressed files is returned.
+        """
+        # Dictionary to match arguments with config file constants
+        dictionary = {
+            "filename": self._config["FILES_FILENAME"],
+            "individual_id": "metadata." + self._config["FILES_INDIVIDUAL_ATTR"],
+            "file_type": "metadata." + self._config["FILES_TYPE"],
+            "description": "metadata." + self._config["FILES_DESCRIPTION"],
+        }
+        # Building query
+        query = {}
+        try:
+            query = {dictionary[k]: kwargs[k] for k in kwargs}
+        except KeyError as e:
+            print("Warning: invalid keyword argument:", e)
+            print("Expected kwargs:", dictionary.keys)
+
+        query["metadata." + self._config["FILES_DELETED_ATTR"]] = {"$ne": True}
+        if projection is None:
+            projection = {
+                "chunkSize": 0,
+                "metadata." + self._config["FILES_FRAMES_ATTR"]: 0,
+            }
+        return _paged_find(
+            self._db.fs.files, query, projection, batch_size, limit, skip, after
+        )
+
+    def get_files(self, files, directory=".", workers=1, on_collision="overwrite"):
+        """Download a list of files from the database.
+
+        The files are downloaded to the given directory, maintaning their
+        original names. Each file is streamed to disk one GridFS chunk at a time,
+        so files of any size can be downloaded without loading them into memory.
+
+        Returns a list with the paths of the files written.
+
+        Parameters
+        ----------
+        files                   List of dicts describing the files to download,
+                                such as the one returned by list_files. Each dict
+                                must contain the "_id" field of the file to
+                                download.
+        directory="."           Directory to download the files to.
+        workers=1               Number of files downloaded in parallel.
+        on_collision="overwrite"
+                                What to do when the target path already exists or
+                                two files with the same name are specified:
+                                "overwrite" keeps the last one, "skip" keeps the
+                                existing one and "rename" appends a counter to the
+                                name, e.g. "reads (1).fastq".
+        """
+        if on_collision not in ("overwrite", "skip", "rename"):
+            raise Exception("Invalid on_collision option.")
+        # Target paths are resolved up front, so downloads never race each other.
+        jobs: dict = {}  # path -> GridOut
+        for file_doc in files:
+            filename, grid_out = self.__open_file(file_doc["_id"])
+            path = os.path.join(directory, filename)
+            if on_collision == "skip" and (path in jobs or os.path.exists(path)):
+                continue
+            if on_collision == "rename":
+                name, ext = os.path.splitext(path)
+                i = 1
+                while path in jobs or os.path.exists(path):
+                    path = f"{name} ({i}){ext}"
+                    i += 1
+            jobs[path] = grid_out
+
+        if workers > 1:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                for _ in executor.map(self.__download_file, jobs.values(), jobs.keys()):
+                    pass
+        else:
+            for path, grid_out in jobs.items():
+                self.__download_file(grid_out, path)
+        return list(jobs.keys())
+
+    def read_file_range(self, file_id, offset, length):
+        """Read part of a file stored in the database.
+
+        Only the GridFS chunks covering the requested range are fetched.
+        Returns the bytes read, which may be fewer than length (or none) if
+        the range goes past the end of the file.
+
+        Parameters
+        ----------
+        file_id     The "_id" of the file, as returned by list_files.
+        offset      Position of the first byte to read.
+        length      Number of bytes to read.
+        """
+        return self._read_contents(self._file_contents(file_id), offset, length)
+
+    def open_file(self, file_id, buffer_size=None):
+        """Open a file stored in the database as a buffered, seekable file object.
+
+        Parameters
+        ----------
+        file_id             The "_id" of the file, as returned by list_files.
+        buffer_size=None    Size of the read buffer. Defaults to the file's
+                            GridFS chunk size, or to the size of its first
+                            frame for compressed files.
+        """
+        raw = StoredFileReader(file_id, self)
+        if buffer_size is None:
+            frames = (raw._doc.get("metadata") or {}).get(
+                self._config["FILES_FRAMES_ATTR"]
+            )
+            buffer_size = frames[0][0] if frames else raw._doc["chunkSize"]
+        return io.BufferedReader(raw, buffer_size)
+
+    def get_fastq_index(self, file_id):
+        """Return the index of a FASTQ file built by insert_file.
+
+        The index is a dict with the fields below, or None if the file wasn't
+        indexed.
+
+        every           One of every this many records has its offset stored.
+        offsets         Offsets of records 0, every, 2 * every...
+        reads           Number of reads in the file.
+        bases           Number of bases in the file.
+        length_counts   Dict mapping each read length (as a string) to the number
+                        of reads with that length.
+        min_length      Length of the shortest read.
+        max_length      Length of the longest read.
+        mean_length     Mean read length.
+        quality_counts  Dict mapping each Phred quality (as a string) to the
+                        number of bases with that quality.
+        mean_quality    Mean Phred quality of all bases.
+
+        The same statistics are stored in the file's metadata under
+        FILES_STATS_ATTR.
+
+        Parameters
+        ----------
+        file_id     The "_id" of the file, as returned by list_files.
+        """
+        return self._fastq_indexes.find_one(
+            {"_id": self._file_contents(file_id)["_id"]}
+        )
+
+    def read_fastq_records(self, file_id, start=0, count=1):
+        """Read records from an indexed FASTQ file stored in the database.
+
+        Only the part of the file holding the records is fetched (see
+        open_file). Returns a list of dicts with the "name", "sequence" and
+        "quality" of each record.
+
+        Parameters
+        ----------
+        file_id     The "_id" of the file, as returned by list_files.
+        start=0     Number of the first record to read, starting from 0.
+        count=1     Number of records to read.
+        """
+        index = self.get_fastq_index(file_id)
+        if index is None:
+            raise Exception("File has no FASTQ index.")
+        records = []
+        if start >= index["reads"]:
+            return records
+        with self.open_file(file_id) as f:
+            f.seek(index["offsets"][start // index["every"]])
+            for _ in range(4 * (start % index["every"])):
+                f.readline()
+            while len(records) < count:
+                header = f.readline().strip()
+                if len(header) == 0:
+                    break
+                sequence, _, quality = f.readline(), f.readline(), f.readline()
+                records.append(
+                    {
+                        "name": header[1:].decode(),
+                        "sequence": sequence.strip().decode(),
+                        "quality": quality.strip().decode(),
+                    }
+                )
+        return records
+
+    def import_map(
+        self,
+        map_reader,
+        map_name,
+        force_create_new=False,
+        force_use_existing=False,
+        report=False,
+        rebuild_indexes=False,
+        write_concern=None,
+    ):
+        """Import map into the database using a MapReader.
+
+        Parameters
+        ----------
+        map_reader                  A MapReader instance.
+        map_name                    The identifier the map will have inside the
+                                    database.
+        force_create_new=False      If False, for each SNP being imported, tries
+                                    to find similar SNPs already on the database.
+                                    If at least one is found, the user is asked
+                                    to choose between creating a new SNP or using
+                                    one of the similars found.
+                                    SNPs are considered similar if their
+                                    chromosomes and positions match exactly.
+                                    If True, new SNPs are always created.
+        force_use_existing=False    If True, will always try to use similar
+                                    (see parameter above) SNPs instead of creating
+                                    new ones. If only one similar SNP is found, it
+                                    is used automatically. If more than one is
+                                    found, the user is asked to choose. If none is
+                                    found, a new SNP is created. This and the
+                                    previous parameter cannot be True at the same
+                                    time.
+        report=False                If True, import results are printed after
+                                    finished. If False, nothing is printed.
+        rebuild_indexes=False       If True, the import runs in its own import
+                                    session (see import_session) deferring the
+                                    indexes of the SNP and map collections.
+                                    Warning: only use this option if a large volume
+                                    of data is being imported, as recreating an index
+                                    takes may take a large amount of time. To import
+                                    several maps, use a single import session.
+        write_concern=None          Write concern of the import's writes (see
+                                    SnpDB). If None, this handle's.
+
+        The lookups made by the import (e.g. for similar SNPs) always read from
+        the primary, whatever the handle's read preference, so they see the
+        latest writes.
+        """
+        if write_concern is not None or not self.__reads_primary():
+            return self.with_options(
+                write_concern=write_concern, read_preference="primary"
+            ).import_map(
+                map_reader,
+                map_name,
+                force_create_new=force_create_new,
+                force_use_existing=force_use_existing,
+                report=report,
+                rebuild_indexes=rebuild_indexes,
+            )
+        if rebuild_indexes and self.__sessions["open"] == 0:
+            colls = [self._maps.name, self._mapsnps.name, self._snps.name]
+            with self.import_session(colls):
+                return self.import_map(
+                    map_reader,
+                    map_name,
+                    force_create_new=force_create_new,
+                    force_use_existing=force_use_existing,
+                    report=report,
+                )
+
+        if len(self.find_maps(id=map_name)) > 0:
+            raise Exception("Map name already in use.")
+
+        # Determine internal IDs for each SNP, possibly with user
+        # interaction.
+        nsnps = len(map_reader)
+        snp_ids = self.__fill_snp_ids(map_reader, force_create_new, force_use_existing)
+
+        if snp_ids is None:
+            return
+
+        # Insert new map into maps collection.
+        map_doc = {
+            "_id": map_name,
+            self._config["MAPS_SIZE_ATTR"]: nsnps,
+            self._config["MAPS_BLOCK_SIZE_ATTR"]: self._config[
+                "SNPBLOCKS_SNPS_PER_BLOCK"
+            ],
+        }
+        map_doc.update(map_reader.map_meta())
+        self._maps.insert_one(map_doc)
+        self.__map_cache.pop(map_name, None)
+        self._inserted[self._maps.name] += 1
+
+        # Insert map snp list (both original order and sorted by id)
+        # into map snps collection.
+        BS = self._config["MAPSNPS_MAX_LIST_SIZE"]
+        snp_list = [x[0] for x in snp_ids]
+        s_snp_list = sorted(snp_list)
+        nlists = (nsnps - 1) // BS + 1
+        self._mapsnps.insert_many(
+            (
+                {
+                    self._config["MAPSNPS_MAP_ATTR"]: map_name,
+                    self._config["MAPSNPS_IDX_ATTR"]: i,
+                    self._config["MAPSNPS_LIST_ATTR"]: snp_list[i * BS : i * BS + BS],
+                    self._config["MAPSNPS_SORTED_LIST_ATTR"]: s_snp_list[
+                        i * BS : i * BS + BS
+                    ],
+                }
+                for i in range(0, nlists)
+            ),
+            ordered=self._ordered,
+        )
+        self._inserted[self._mapsnps.name] += nlists
+
+        # Insert new SNPs into snps collection.
+        new_snps = [
+            self.__adjust_snp(snp, map_reader, snp_ids[i][0])
+            for (i, snp) in enumerate(map_reader)
+            if snp_ids[i][1]
+        ]
+        if len(new_snps) > 0:
+            self._snps.insert_many(new_snps, ordered=self._ordered)
+            self._inserted[self._snps.name] += len(new_snps)
+
+        # For each SNP (old or new), add the new map to the SNP's map list.
+        self._snps.bulk_write(
+            [
+                UpdateOne(
+                    {"_id": snp_ids[j][0]},
+                    {"$push": {self._config["SNPS_MAPS_ATTR"]: map_name}},
+                )
+                for j in range(nsnps)
+            ],
+            ordered=self._ordered,
+        )
+
+        if report:
+            print(
+                f"Added map {map_name} with {nsnps} SNPs, "
+                + f"{len(new_snps)} new SNPs created."
+            )
+
+    def import_samples(
+        self,
+        sample_reader,
+        map_name,
+        id_map={},
+        report=False,
+        rebuild_indexes=False,
+        write_concern=None,
+    ):
+        """Import samples into the database using a SampleReader.
+
+        Parameters
+        ----------
+        sample_reader               A SampleReader instance.
+        map_name                    The map id associated with the samples being imported.
+                                    Must exist on the database.
+        id_map={}                   A dict associating sample IDs (key) with individual
+                                    tatoos (value). Sample IDs which have an associated
+                                    individual tatoo will be associated to the individual
+                                    in question. If it doesn't exist, it'll be created.
+                                    If more than one exists with the same tatoo, the user
+                                    will be asked to choose between them.
+        report=False                If True, import results are printed after finished.
+                                    IF False, nothing is printed.
+        rebuild_indexes=False       If True, the import runs in its own import
+                                    session (see import_session) deferring the
+                                    indexes of the sample, block and individual
+                                    collections.
+                                    Warning: only use this option if a large volume
+                                    of data is being imported, as recreating an index
+                                    takes may take a large amount of time. To import
+                                    several files, use a single import session.
+        write_concern=None          Write concern of the import's writes (see
+                                    SnpDB). If None, this handle's.
+
+        The lookups made by the import (e.g. for individuals by tatoo) always
+        read from the primary, whatever the handle's read preference, so they
+        see the latest writes.
+        """
+        if write_concern is not None or not self.__reads_primary():
+            return self.with_options(
+                write_concern=write_concern, read_preference="primary"
+            ).import_samples(
+                sample_reader,
+                map_name,
+                id_map=id_map,
+                report=report,
+                rebuild_indexes=rebuild_indexes,
+            )
+        if rebuild_indexes and self.__sessions["open"] == 0:
+            colls = [self._samples.name, self._snpblocks.name, self._inds.name]
+            with self.import_session(colls):
+                return self.import_samples(
+                    sample_reader, map_name, id_map=id_map, report=report
+                )
+
+        try:
+            m = self.find_maps(id=map_name)[0]
+        except IndexError:
+            raise Exception("Map not found.") from None
+
+        snps, sorted_snps = self.get_map_snps(map_name)
+        bsize = m[self._config["MAPS_BLOCK_SIZE_ATTR"]]
+
+        new_samples = 0
+        new_blocks = 0
+        new_individuals = 0
+        old_individuals = 0
+
+        # Each sample is inserted, then its blocks, then it's linked to its
+        # individual. Under bulk_load, samples and blocks are inserted in
+        # batches instead: pending samples are always sent before pending
+        # blocks, and before linking any of them. If the blocks collection is
+        # sharded, its batches are grouped by target chunk, so each one goes
+        # to a single shard instead of every batch being split among all.
+        chunk_of = _chunk_router(self._snpblocks)
+        pending_samples = []
+        pending_blocks = {}
+
+        def insert(coll, docs):
+            if len(docs) > 0:
+                coll.insert_many(docs, ordered=self._ordered)
+                self._inserted[coll.name] += len(docs)
+
+        def flush_samples():
+            insert(self._samples, pending_samples)
+            pending_samples.clear()
+
+        def flush():
+            flush_samples()
+            for chunk in list(pending_blocks):
+                insert(self._snpblocks, pending_blocks.pop(chunk))
+
+        for sample in sample_reader:
+            genotype = sample.pop(sample_reader.SAMPLE_GENOTYPE)
+            id = sample.pop(sample_reader.SAMPLE_ID)
+
+            for key in genotype:
+                if len(genotype[key]) != len(snps):
+                    raise Exception("Sample genotype and map size mismatch.")
+
+            # Prepare sample object to be inserted.
+            sample_key = {
+                self._config["SAMPLES_MAP_ATTR"]: map_name,
+                self._config["SAMPLES_ID_ATTR"]: id,
+            }
+            sample.update(sample_key)
+            new_samples += 1
+
+            # Sort genotype lists using snp id as key.
+            for key in genotype:
+                if isinstance(genotype[key], str):
+                    genotype[key] = "".join(
+                        [x for _, x in sorted(zip(snps, genotype[key]))]
+                    )
+                else:
+                    genotype[key] = [
+                        str(x) for _, x in sorted(zip(snps, genotype[key]))
+                    ]
+
+            # Break genotype into blocks and insert into SNP blocks collection.
+            blocks = []
+            current_block = 0
+            for i in range(0, len(snps), bsize):
+                b_genotype = {}
+                for key in genotype:
+                    if isinstance(genotype[key], str):
+                        b_genotype[key] = genotype[key][i : i + bsize]
+                    else:
+                        b_genotype[key] = " " + " ".join(genotype[key][i : i + bsize])
+                block = {
+                    self._config["SNPBLOCKS_MAP_ATTR"]: map_name,
+                    self._config["SNPBLOCKS_SAMPLE_ATTR"]: id,
+                    self._config["SNPBLOCKS_BLOCK_NUMBER"]: current_block,
+                    self._config["SNPBLOCKS_GENOTYPE"]: b_genotype,
+                }
+                blocks.append(block)
+                new_blocks += 1
+                current_block += 1
+
+            if self._batched:
+                pending_samples.append(sample)
+                for block in blocks:
+                    pending_blocks.setdefault(chunk_of(block), []).append(block)
+                if len(pending_samples) >= _INSERT_BATCH_SIZE or any(
+                    len(docs) >= _INSERT_BATCH_SIZE for docs in pending_blocks.values()
+                ):
+                    flush()
+            else:
+                self._samples.insert_one(sample)
+                self._inserted[self._samples.name] += 1
+                insert(self._snpblocks, blocks)
+
+            # Try to associate the sample with an individual, possibly
+            # interacting with the user.
+            if id in id_map:
+                flush_samples()
+                individuals = self.find_individuals(tatoo=id_map[id])
+                option = 0
+                if len(individuals) > 1:
+                    option = _user_individual_choice(id_map[id], individuals)
+                elif len(individuals) == 1:
+                    option = 1
+                if option == 0:
+                    ind_id = self.__next_individual_id()
+                    self._inds.insert_one(
+                        {
+                            "_id": ind_id,
+                            self._config["INDIVIDUALS_ID_LIST_ATTR"]: [id_map[id]],
+                            self._config["INDIVIDUALS_SAMPLE_LIST_ATTR"]: [sample_key],
+                        }
+                    )
+                    self._inserted[self._inds.name] += 1
+                    new_individuals += 1
+                else:
+                    ind_id = individuals[option - 1]["_id"]
+                    self._inds.update_one(
+                        {"_id": ind_id},
+                        {
+                            "$push": {
+                                self._config["INDIVIDUALS_SAMPLE_LIST_ATTR"]: sample_key
+                            }
+                        },
+                    )
+                    old_individuals += 1
+                if self._config["SUMMARIES_ENABLED"]:
+                    self._summaries.update_one(
+                        {"_id": ind_id},
+                        {
+                            "$push": {"samples": self.__summary_sample(id, m)},
+                            "$addToSet": {"maps": self.__summary_map(m)},
+                        },
+                        upsert=True,
+                    )
+
+        flush()
+
+        if report:
+            print(
+                f"{new_samples} samples added, {new_blocks} blocks, "
+                + f"{new_individuals} individuals created, "
+                + f"{old_individuals} pre-existing individuals updated."
+            )
+
+    def export_map(self, id, map_writer, out_file_path, read_preference=None):
+        """Export map from database to file using a MapWriter.
+
+        The SNPs of the map to be exported should contain
+        all the fields required by the specific MapWriter.
+
+        Parameters
+        ----------
+        id                      Name of the map in the database to export.
+        map_writer              A MapWriter instance.
+        out_file_path           Path of file to export to.
+        read_preference=None    Read preference of the export (see SnpDB),
+                                e.g. "secondaryPreferred". If None, this
+                                handle's.
+        """
+        if read_preference is not None:
+            return self.with_options(read_preference=read_preference).export_map(
+                id, map_writer, out_file_path
+            )
+        snps, _ = self.get_map_snps(id)
+        if len(snps) == 0:
+            raise Exception("Map not found.")
+        where = dict()
+        for i in range(len(snps)):
+            where[snps[i]] = i
+        wsnps = [None] * len(snps)
+        for snp in self._snps.find({self._config["SNPS_MAPS_ATTR"]: id}):
+            wsnps[where[snp["_id"]]] = snp
+        for snp in wsnps:
+            self.__rev_adjust_snp(snp, map_writer)
+        writer = map_writer(wsnps)
+        writer.write(out_file_path)
+
+    def export_samples(
+        self,
+        samples,
+        map,
+        sample_writer,
+        out_file_path,
+        keys=None,
+        read_preference=None,
+    ):
+        """Export samples to file using a SampleWriter.
+
+        The samples to be exported should contain all the fields required by
+        the specific SampleWriter.
+
+        Parameters
+        ----------
+        samples         List containing within-map IDs of samples to be exported.
+                        If empty, all the samples associated with the map will be
+                        exported.
+        map             ID of map with which samples to be exported are associated.
+        sample_writer   A SampleWriter instance.
+        out_file_path   Path of file to export to.
+        keys=None       List of genotype keys to export. If None, all keys
+                        are exported.
+        read_preference=None
+                        Read preference of the export (see SnpDB), e.g.
+                        "secondaryPreferred". If None, this handle's.
+        """
+        if read_preference is not None:
+            return self.with_options(read_preference=read_preference).export_samples(
+                samples, map, sample_writer, out_file_path, keys=keys
+            )
+        # TODO: optimize performance by reducing number of calls to find_sample.
+        wsamples = []
+        if len(samples) == 0:
+            samples = [
+                sample[self._config["SAMPLES_ID_ATTR"]]
+                for sample in self.find_sample(map=map)
+            ]
+        for id in samples:
+            current = {
+                sample_writer.SAMPLE_ID: id,
+                sample_writer.SAMPLE_GENOTYPE: self.get_sample_data(id, map, keys=keys),
+            }
+            sample_info = self.find_sample(id, map)[0]
+            sample_info.pop("_id")
+            current.update(sample_info)
+            wsamples.append(current)
+        writer = sample_writer(wsamples)
+        writer.write(out_file_path)
+
+    def summarize(
+        self,
+        individuals: Union[dict, list],
+        use_summaries=None,
+        read_preference=None,
+    ) -> list:
+        """Summarizes all data about an individual.
+
+        Returns a list of dicts with the following keys:
+        <map format>_sample:<str,str list>     list of maps the individual is in,
+                                    for that format, with sample ids
+        <map format>_sample_count: <int>   count of maps the individual is in,
+                                    for that format
+        <map format>_snps_count: <int> count of snps of individual, for that format
+        files: <str list>           list of file names associated with
+                                    the individual
+        <file type>_file_count: <int>          count of files associated with the
+                                    individual
+
+        Parameters
+        ----------
+        individual      dict or list of dicts representing an individual, as
+                        returned by find_individuals or find_individuals_of_snps
+
+        use_summaries=None  If True, read the materialized summaries kept in
+                        the summaries collection (a single indexed read) instead
+                        of computing them. There, a format's SNP count is the sum
+                        of its maps' sizes, which is exact unless those maps share
+                        SNPs. Defaults to the SUMMARIES_ENABLED config value.
+
+        read_preference=None
+                        Read preference of the call (see SnpDB), e.g.
+                        "secondaryPreferred". If None, this handle's.
+
+        Maps, file metadata and SNP counts for all the individuals are fetched
+        with a fixed number of queries, so summarizing many individuals at once
+        is much cheaper than calling this once per individual.
+        """
+        if read_preference is not None:
+            return self.with_options(read_preference=read_preference).summarize(
+                individuals, use_summaries=use_summaries
+            )
+        result: list = []
+        # Check if individuals is a dict or a list. Return accordingly
+        if isinstance(individuals, dict):
+            individuals = [individuals]
+        individuals = list(individuals)
+        if use_summaries is None:
+            use_summaries = self._config["SUMMARIES_ENABLED"]
+        if use_summaries:
+            docs = {
+                doc["_id"]: doc
+                for doc in self._summaries.find(
+                    {"_id": {"$in": [ind["_id"] for ind in individuals]}}
+                )
+            }
+            return [
+                _summary_result(docs.get(ind["_id"], {"_id": ind["_id"]}))
+                for ind in individuals
+            ]
+        SAMPLES = self._config["INDIVIDUALS_SAMPLE_LIST_ATTR"]
+        FORMAT = self._config["MAPS_FORMAT_ATTR"]
+        SIZE = self._config["MAPS_SIZE_ATTR"]
+        FILE_TYPE = self._config["FILES_TYPE"]
+
+        # Resolve every map referenced by the individuals in a single query.
+        map_names = {
+            sample[self._config["SAMPLES_MAP_ATTR"]]
+            for ind in individuals
+            for sample in ind.get(SAMPLES, [])
+        }
+        map_docs = {
+            m["_id"]: m
+            for m in self._maps.find(
+                {"_id": {"$in": list(map_names)}}, {FORMAT: 1, SIZE: 1}
+            )
+        }
+
+        # Group maps by format for each individual.
+        ind_maps: list = []  # one {format: set of maps} per individual
+        for ind in individuals:
+            maps: dict = {}
+            for sample in ind.get(SAMPLES, []):
+                map_name: str = sample[self._config["SAMPLES_MAP_ATTR"]]
+                if map_name in map_docs:
+                    maps.setdefault(map_docs[map_name][FORMAT], set()).add(map_name)
+            ind_maps.append(maps)
+
+        # A single map's SNP count is its size. SNPs shared between maps must
+        # only be counted once, so for individuals with several maps of a format
+        # count SNPs grouped by the combination of those maps they belong to,
+        # in one aggregation, and add up the groups that touch each map set.
+        shared_maps = {
+            map_name
+            for maps in ind_maps
+            for map_set in maps.values()
+            if len(map_set) > 1
+            for map_name in map_set
+        }
+        combinations: list = []
+        if len(shared_maps) > 0:
+            MAPS_ATTR = self._config["SNPS_MAPS_ATTR"]
+            pipeline = [
+                {"$match": {MAPS_ATTR: {"$in": list(shared_maps)}}},
+                {
+                    "$group": {
+                        "_id": {
+                            "$filter": {
+                                "input": "$" + MAPS_ATTR,
+                                "cond": {"$in": ["$$this", list(shared_maps)]},
+                            }
+                        },
+                        "n": {"$sum": 1},
+                    }
+                },
+            ]
+            combinations = [
+                (set(group["_id"]), group["n"])
+                for group in self._snps.aggregate(pipeline)
+            ]
+        snps_counts: dict = {}
+
+        # Retrieve files of all individuals in a single query.
+        files = self.list_files_for_individuals(
+            [ind["_id"] for ind in individuals],
+            projection=[
+                self._config["FILES_FILENAME"],
+                "metadata." + self._config["FILES_TYPE"],
+            ],
+        )
+
+        for ind, maps in zip(individuals, ind_maps):
+            ind_result: dict = {
+                "individual_id": ind["_id"],
+                "files": [],
+                "files_count": 0,
+            }
+            # Retrieving maps/samples with formats
+            for sample in ind.get(SAMPLES, []):
+                map_name: str = sample[self._config["SAMPLES_MAP_ATTR"]]
+                sample_id: str = sample[self._config["SAMPLES_ID_ATTR"]]
+                if map_name not in map_docs:
+                    print(f"Warning: couldn't retrieve format for map {map_name}")
+                    continue
+                map_format: str = map_docs[map_name][FORMAT]
+                ind_result[map_format + "_sample_count"] = (
+                    ind_result.get(map_format + "_sample_count", 0) + 1
+                )
+                ind_result[map_format + "_sample"] = ind_result.get(
+                    map_format + "_sample", []
+                ) + [(map_name, sample_id)]
+            # Counting snps associated with ind
+            for map_format, map_set in maps.items():
+                if len(map_set) == 1:
+                    count = map_docs[next(iter(map_set))][SIZE]
+                else:
+                    key = frozenset(map_set)
+                    if key not in snps_counts:
+                        snps_counts[key] = sum(
+                            n
+                            for combination, n in combinations
+                            if combination & map_set
+                        )
+                    count = snps_counts[key]
+                ind_result[map_format + "_snps_count"] = count
+            # Retrieving files of individual
+            for f in files.get(ind["_id"], []):
+                try:
+                    ind_result["files"].append(f[self._config["FILES_FILENAME"]])
+                except KeyError as e:
+                    print(
+                        "Warning (",
+                        e,
+                        "): couldn't retrieve filename for file associated with",
+                        f"individual {ind['_id']}",
+                    )
+                # Retrieving count of files by type
+                try:
+                    ind_result[f["metadata"][FILE_TYPE] + "_file_count"] = (
+                        ind_result.get(f["metadata"][FILE_TYPE] + "_file_count", 0) + 1
+                    )
+                except KeyError as e:
+                    print(
+                        "Warning (",
+                        e,
+                        "): couldn't retrieve file type for file associated with",
+                        f"individual {ind['_id']}",
+                    )
+            # Appending individual summary to result
+            result.append(ind_result)
+        return result
+
+    def rebuild_summaries(self, batch_size=1000, report=False):
+        """Recompute the materialized summaries of all individuals.
+
+        The summaries collection is kept up to date incrementally by
+        import_samples, insert_file and delete_individuals while
+        SUMMARIES_ENABLED is set. Use this to build it for the first time, or to
+        fix any drift (e.g. after changes made with the option disabled).
+
+        The summaries are written to a temporary collection which, once its
+        indexes (from the INDEXES spec) are built, replaces the current one,
+        so readers keep seeing the previous summaries until the rebuild is
+        complete. Incremental updates made to the current collection while it
+        runs are lost, so run it when no imports, uploads or deletes are in
+        progress (or rebuild again afterwards).
+
+        Parameters
+        ----------
+        batch_size=1000     Number of individuals summarized per round of queries.
+        report=False        If True, print the number of summaries written.
+        """
+        SAMPLES = self._config["INDIVIDUALS_SAMPLE_LIST_ATTR"]
+        maps = {m["_id"]: m for m in self.find_maps()}
+        rebuild = self._db[self._config["SUMMARIES_COLL"] + "_rebuild"]
+        rebuild.drop()
+        total = 0
+        individuals = self.iter_individuals(
+            projection=["_id", SAMPLES], batch_size=batch_size
+        )
+        batch = []
+        for ind in individuals:
+            batch.append(ind)
+            if len(batch) < batch_size:
+                continue
+            total += self.__rebuild_summaries_batch(batch, maps, rebuild)
+            batch = []
+        if len(batch) > 0:
+            total += self.__rebuild_summaries_batch(batch, maps, rebuild)
+        indexes = _index_spec(self._config).get(self._config["SUMMARIES_COLL"], [])
+        if len(indexes) > 0:
+            rebuild.create_indexes([model for model, _ in indexes])
+        if total > 0 or len(indexes) > 0:
+            rebuild.rename(self._config["SUMMARIES_COLL"], dropTarget=True)
+        else:
+            self._summaries.delete_many({})
+        if report:
+            print(f"{total} individual summaries rebuilt.")
+
+    def collect_garbage(
+        self,
+        batch_size=1000,
+        throttle=0.0,
+        report_only=False,
+        report=False,
+        min_age=None,
+    ):
+        """Find and delete orphaned data left by partial imports or deletes.
+
+        Three kinds of orphans are handled, in this order:
+        - samples whose map no longer exists (their blocks are deleted and
+          they're unlinked from individuals as well);
+        - SNP blocks without a matching sample;
+        - SNPs that don't belong to any map.
+
+        Collections are scanned in batches of batch_size documents, joined
+        against the referenced collection through its indexes, sleeping
+        throttle seconds between batches, so it can run alongside regular
+        traffic. Samples and blocks created less than min_age seconds ago are
+        skipped, as they may belong to an import still running, and each
+        orphan is checked again right before it is deleted. SNPs need no such
+        window, as import_map inserts new SNPs without the map list that the
+        query for SNPs without maps matches. The counts found are returned as
+        a dict and also stored in the maintenance log collection.
+
+        Parameters
+        ----------
+        batch_size=1000     Number of documents examined per batch.
+        throttle=0.0        Seconds to sleep between batches.
+        report_only=False   If True, orphans are only counted, not deleted.
+        report=False        If True, the counts are printed when finished.
+        min_age=None        Minimum age in seconds of the samples and blocks
+                            considered. If None, the configuration's
+                            GC_MIN_AGE. It should be well above the duration
+                            of the longest import.
+        """
+        started = datetime.now(timezone.utc)
+        if min_age is None:
+            min_age = self._config["GC_MIN_AGE"]
+        cutoff = ObjectId.from_datetime(started - timedelta(seconds=min_age))
+        SAMPLES = self._config["INDIVIDUALS_SAMPLE_LIST_ATTR"]
+        MAP = self._config["SAMPLES_MAP_ATTR"]
+        ID = self._config["SAMPLES_ID_ATTR"]
+        BLOCK_MAP = self._config["SNPBLOCKS_MAP_ATTR"]
+        BLOCK_SAMPLE = self._config["SNPBLOCKS_SAMPLE_ATTR"]
+        counts = {"samples": 0, "snpblocks": 0, "snps": 0}
+
+        # Samples whose map is gone.
+        ids = {"$lt": cutoff}
+        while True:
+            pipeline = [
+                {"$match": {"_id": ids}},
+                {"$sort": {"_id": 1}},
+                {"$limit": batch_size},
+                {"$project": {MAP: 1, ID: 1}},
+                {
+                    "$lookup": {
+                        "from": self._config["MAPS_COLL"],
+                        "localField": MAP,
+                        "foreignField": "_id",
+                        "as": "maps",
+                    }
+                },
+                {"$project": {MAP: 1, ID: 1, "found": {"$size": "$maps"}}},
+            ]
+            batch = list(self._samples.aggregate(pipeline))
+            if len(batch) == 0:
+                break
+            ids["$gt"] = batch[-1]["_id"]
+            for sample in batch:
+                if sample["found"] > 0:
+                    continue
+                if report_only:
+                    counts["samples"] += 1
+                    continue
+                if self._maps.find_one({"_id": sample[MAP]}, {"_id": 1}) is not None:
+                    continue
+                counts["samples"] += 1
+                self._inds.update_many(
+                    {SAMPLES + "." + MAP: sample[MAP], SAMPLES + "." + ID: sample[ID]},
+                    {"$pull": {SAMPLES: {MAP: sample[MAP], ID: sample[ID]}}},
+                )
+                if self._config["SUMMARIES_ENABLED"]:
+                    self._summaries.update_many(
+                        {"samples.map": sample[MAP], "samples.id": sample[ID]},
+                        {"$pull": {"samples": {"map": sample[MAP], "id": sample[ID]}}},
+                    )
+                self._snpblocks.delete_many(
+                    {BLOCK_MAP: sample[MAP], BLOCK_SAMPLE: sample[ID]}
+                )
+                self._samples.delete_one({"_id": sample["_id"]})
+            time.sleep(throttle)
+
+        # Blocks without a sample. Each batch of blocks is grouped by sample and
+        # looked up through the samples' id index.
+        ids = {"$lt": cutoff}
+        while True:
+            pipeline = [
+                {"$match": {"_id": ids}},
+                {"$sort": {"_id": 1}},
+                {"$limit": batch_size},
+                {
+                    "$group": {
+                        "_id": {"m": "$" + BLOCK_MAP, "s": "$" + BLOCK_SAMPLE},
+                        "n": {"$sum": 1},
+                        "last": {"$max": "$_id"},
+                    }
+                },
+                {
+                    "$lookup": {
+                        "from": self._config["SAMPLES_COLL"],
+                        "localField": "_id.s",
+                        "foreignField": ID,
+                        "as": "samples",
+                    }
+                },
+                {
+                    "$project": {
+                        "n": 1,
+                        "last": 1,
+                        "found": {"$in": ["$_id.m", "$samples." + MAP]},
+                    }
+                },
+            ]
+            batch = list(self._snpblocks.aggregate(pipeline))
+            if len(batch) == 0:
+                break
+            ids["$gt"] = max(group["last"] for group in batch)
+            for group in batch:
+                if group["found"]:
+                    continue
+                if report_only:
+                    counts["snpblocks"] += group["n"]
+                    continue
+                map_name, sample_id = group["_id"]["m"], group["_id"]["s"]
+                if (
+                    self._samples.find_one({MAP: map_name, ID: sample_id}, {"_id": 1})
+                    is not None
+                ):
+                    continue
+                counts["snpblocks"] += self._snpblocks.delete_many(
+                    {
+                        BLOCK_MAP: map_name,
+                        BLOCK_SAMPLE: sample_id,
+                        "_id": {"$lt": cutoff},
+                    }
+                ).deleted_count
+            time.sleep(throttle)
+
+        # SNPs without maps. An empty array query can use the maps index.
+        query = {self._config["SNPS_MAPS_ATTR"]: []}
+        if report_only:
+            counts["snps"] = self._snps.count_documents(query)
+        else:
+            while True:
+                ids = [
+                    snp["_id"]
+                    for snp in self._snps.find(query, {"_id": 1}, limit=batch_size)
+                ]
+                if len(ids) == 0:
+                    break
+                counts["snps"] += self._snps.delete_many(
+                    {"_id": {"$in": ids}, self._config["SNPS_MAPS_ATTR"]: []}
+                ).deleted_count
+                time.sleep(throttle)
+
+        self._maintenance.insert_one(
+            {
+                "job": "gc",
+                "started": started,
+                "finished": datetime.now(timezone.utc),
+                "report_only": report_only,
+                "orphans": counts,
+            }
+        )
+        if report:
+            print(
+                f"{'Found' if report_only else 'Deleted'} {counts['samples']} "
+                + f"samples without map, {counts['snpblocks']} blocks without "
+                + f"sample, {counts['snps']} SNPs without map."
+            )
+        return counts
+
+    # Used for testing purposes.
+    def get_db_stats(self, scale=1):
+        colls = [self._config[key] for key in self._config if key[-4:] == "COLL"]
+        for coll in colls:
+            self._db.command("validate", coll, full=True)
+        return self._db.command("dbstats", scale=scale)
+
+    def __drop_deferred_indexes(self, collections):
+        for name, indexes in _index_spec(self._config).items():
+            if collections is not None and name not in collections:
+                continue
+            existing = self._db[name].index_information()
+            for model, defer in indexes:
+                if defer and model.document["name"] in existing:
+                    self._db[name].drop_index(model.document["name"])
+
+    def __cached_map(self, name):
+        # Returns (map document, SNP ids, sorted SNP ids) of a map from the
+        # cache (see map_cache_ttl), fetching them if missing or expired, or
+        # None if the cache is disabled. Raises IndexError if there is no map.
+        if self.__map_cache_ttl <= 0:
+            return None
+        now = time.monotonic()
+        entry = self.__map_cache.get(name)
+        if entry is None or now - entry[0] > self.__map_cache_ttl:
+            maps = self.find_maps(id=name)
+            if len(maps) == 0:
+                self.__map_cache.pop(name, None)
+                raise IndexError(name)
+            entry = (now, maps[0]) + self.get_map_snps(name)
+            self.__map_cache[name] = entry
+        return entry[1:]
+
+    def __reads_primary(self):
+        return self._db.read_preference == ReadPreference.PRIMARY
+
+    def __reserve_snp_ids(self, cnt):
+        doc = self._counters.find_one_and_update(
+            {"_id": self._config["SNPS_COLL"]},
+            {"$inc": {self._config["COUNTERS_SEQ_VALUE_ATTR"]: cnt}},
+        )
+        return doc[self._config["COUNTERS_SEQ_VALUE_ATTR"]]
+
+    def __adjust_snp(self, snp, map_reader, id=None):
+        if id is not None:
+            snp["_id"] = id
+        if map_reader.SNP_NAME in snp:
+            snp[self._config["SNPS_NAME_ATTR"]] = snp.pop(map_reader.SNP_NAME)
+        if map_reader.SNP_CHROM in snp:
+            snp[self._config["SNPS_CHROMOSOME_ATTR"]] = snp.pop(map_reader.SNP_CHROM)
+        if map_reader.SNP_POS in snp:
+            snp[self._config["SNPS_POSITION_ATTR"]] = snp.pop(map_reader.SNP_POS)
+        return snp
+
+    def __rev_adjust_snp(self, snp, map_writer):
+        snp.pop("_id")
+        if self._config["SNPS_NAME_ATTR"] in snp:
+            snp[map_writer.SNP_NAME] = snp.pop(self._config["SNPS_NAME_ATTR"])
+        if self._config["SNPS_CHROMOSOME_ATTR"] in snp:
+            snp[map_writer.SNP_CHROM] = snp.pop(self._config["SNPS_CHROMOSOME_ATTR"])
+        if self._config["SNPS_POSITION_ATTR"] in snp:
+            snp[map_writer.SNP_POS] = snp.pop(self._config["SNPS_POSITION_ATTR"])
+
+    def __find_similar_snps(self, snp):
+        query = {}
+        for attr in [
+            self._config["SNPS_CHROMOSOME_ATTR"],
+            self._config["SNPS_POSITION_ATTR"],
+        ]:
+            if attr not in snp:
+                return []
+            query[attr] = snp[attr]
+        return list(self._snps.find(query))
+
+    def __fill_snp_ids(self, map_reader, force_create_new, force_use_existing):
+        if force_create_new and force_use_existing:
+            raise Exception(
+                "force_create_new and force_use_existing cannot"
+                " be used simultaneously."
+            )
+        next_id = self.__reserve_snp_ids(len(map_reader))
+        snp_ids = []
+        for snp in map_reader:
+            self.__adjust_snp(snp, map_reader)
+            if force_create_new:
+                snp_ids.append((next_id, True))
+                next_id += 1
+                continue
+            similar = self.__find_similar_snps(snp)
+            if len(similar) == 0:
+                snp_ids.append((next_id, True))
+                next_id += 1
+            elif len(similar) == 1 and force_use_existing:
+                snp_ids.append((similar[0]["_id"], False))
+            else:
+                user_choice = _user_snp_choice(snp, similar, force_use_existing)
+                if user_choice is None:
+                    return None
+                if user_choice in {"e", "E"}:
+                    snp_ids.append((similar[0]["_id"], False))
+                    force_use_existing = True
+                elif user_choice in {"0", "n", "N"}:
+                    snp_ids.append((next_id, True))
+                    next_id += 1
+                    force_create_new = user_choice in {"n", "N"}
+                else:
+                    snp_ids.append((similar[int(user_choice) - 1]["_id"], False))
+        return snp_ids
+
+    def __genotype_projection(self, keys):
+        GEN = self._config["SNPBLOCKS_GENOTYPE"]
+        if keys is None:
+            return {GEN: 1}
+        return {GEN + "." + key: 1 for key in keys}
+
+    def __summary_sample(self, sample_id, map_doc):
+        return {
+            "map": map_doc["_id"],
+            "id": sample_id,
+            "format": map_doc[self._config["MAPS_FORMAT_ATTR"]],
+        }
+
+    def __summary_map(self, map_doc):
+        return {
+            "map": map_doc["_id"],
+            "format": map_doc[self._config["MAPS_FORMAT_ATTR"]],
+            "size": map_doc[self._config["MAPS_SIZE_ATTR"]],
+        }
+
+    def __summary_file(self, file_doc):
+        return {
+            "_id": file_doc["_id"],
+            "filename": file_doc.get(self._config["FILES_FILENAME"]),
+            "type": file_doc.get("metadata", {}).get(self._config["FILES_TYPE"]),
+        }
+
+    def __rebuild_summaries_batch(self, individuals, maps, collection):
+        SAMPLES = self._config["INDIVIDUALS_SAMPLE_LIST_ATTR"]
+        docs = {}
+        for ind in individuals:
+            doc = {"_id": ind["_id"], "samples": [], "maps": [], "files": []}
+            for sample in ind.get(SAMPLES, []):
+                map_doc = maps.get(sample[self._config["SAMPLES_MAP_ATTR"]])
+                if map_doc is None:
+                    continue
+                doc["samples"].append(
+                    self.__summary_sample(
+                        sample[self._config["SAMPLES_ID_ATTR"]], map_doc
+                    )
+                )
+                if self.__summary_map(map_doc) not in doc["maps"]:
+                    doc["maps"].append(self.__summary_map(map_doc))
+            docs[ind["_id"]] = doc
+        files = self.list_files_for_individuals(
+            list(docs),
+            projection=[
+                self._config["FILES_FILENAME"],
+                "metadata." + self._config["FILES_TYPE"],
+            ],
+        )
+        for id, id_files in files.items():
+            docs[id]["files"].extend(self.__summary_file(f) for f in id_files)
+        collection.insert_many(docs.values())
+        return len(docs)
+
+    def __put_file(self, file, filename, metadata, dedup, codec, analyzer):
+        HASH = self._config["FILES_HASH_ATTR"]
+        metadata = dict(metadata)
+        checked = dedup and getattr(file, "seekable", lambda: False)()
+        if checked:
+            start = file.tell()
+            hasher = hashlib.sha256()
+            data = file.read(_CHUNK_SIZE)
+            while len(data) > 0:
+                hasher.update(data)
+                data = file.read(_CHUNK_SIZE)
+            file.seek(start)
+            content = self.__find_content(hasher.hexdigest())
+            if content is not None:
+                return self.__link_file(content, filename, metadata)
+
+        read_size = _CHUNK_SIZE
+        if codec is not None:
+            compress, _ = _codec(codec)
+            read_size = self._config["FILES_FRAME_SIZE"]
+            # Frame index: [uncompressed end, compressed end] of each frame.
+            frames = []
+            size = stored = 0
+
+        if analyzer is not None:
+            analyze, analysis = _start_analyzer(analyzer)
+        grid_in = self._gfs.new_file(filename=filename, metadata=metadata)
+        hasher = hashlib.sha256()
+        try:
+            data = file.read(read_size)
+            while len(data) > 0:
+                hasher.update(data)
+                if analyzer is not None:
+                    analyze(data)
+                if codec is not None:
+                    size += len(data)
+                    data = compress(data)
+                    stored += len(data)
+                    frames.append([size, stored])
+                grid_in.write(data)
+                data = file.read(read_size)
+            if analyzer is not None:
+                metadata[self._config["FILES_STATS_ATTR"]] = analysis()
+        except BaseException:
+            if analyzer is not None:
+                analysis(wait_only=True)
+            grid_in.abort()
+            raise
+        metadata[HASH] = hasher.hexdigest()
+        if codec is not None:
+            metadata[self._config["FILES_CODEC_ATTR"]] = codec
+            metadata[self._config["FILES_SIZE_ATTR"]] = size
+            metadata[self._config["FILES_FRAMES_ATTR"]] = frames
+        grid_in.metadata = metadata
+        grid_in.close()
+
+        content_id, file_id = grid_in._id, grid_in._id
+        if dedup and not checked:
+            # Unseekable files can only be checked once they are uploaded.
+            # The stored copy with the lowest id is kept, so that concurrent
+            # uploads of the same contents all agree on which one survives.
+            content = self.__find_content(metadata[HASH])
+            if content["_id"] != grid_in._id:
+                self._gfs.delete(grid_in._id)
+                content_id = content["_id"]
+                file_id = self.__link_file(content, filename, metadata)
+        stats = metadata.get(self._config["FILES_STATS_ATTR"], {})
+        if (
+            isinstance(analyzer, FastqIndexer)
+            and analyzer.every is not None
+            and "error" not in stats
+        ):
+            index = dict(stats)
+            index.update({"_id": content_id, "every": analyzer.every})
+            index["offsets"] = analyzer.offsets
+            self._fastq_indexes.replace_one({"_id": content_id}, index, upsert=True)
+        return file_id
+
+    def __find_content(self, digest):
+        # Returns the stored contents with a hash, the one with the lowest id
+        # if there are several.
+        query = {
+            "metadata." + self._config["FILES_HASH_ATTR"]: digest,
+            "metadata." + self._config["FILES_CONTENT_ATTR"]: {"$exists": False},
+        }
+        return self._db.fs.files.find_one(query, sort=[("_id", ASCENDING)])
+
+    def __link_file(self, content, filename, metadata):
+        metadata = dict(metadata)
+        metadata[self._config["FILES_HASH_ATTR"]] = content["metadata"][
+            self._config["FILES_HASH_ATTR"]
+        ]
+        if self._config["FILES_STATS_ATTR"] in content["metadata"]:
+            metadata[self._config["FILES_STATS_ATTR"]] = content["metadata"][
+                self._config["FILES_STATS_ATTR"]
+            ]
+        metadata[self._config["FILES_CONTENT_ATTR"]] = content["_id"]
+        doc = {
+            "_id": ObjectId(),
+            "filename": filename,
+            "length": content["length"],
+            "chunkSize": content["chunkSize"],
+            "uploadDate": datetime.now(timezone.utc),
+            "metadata": metadata,
+        }
+        self._db.fs.files.insert_one(doc)
+        self._db.fs.files.update_one(
+            {"_id": content["_id"]},
+            {"$inc": {"metadata." + self._config["FILES_REFS_ATTR"]: 1}},
+        )
+        return doc["_id"]
+
+    def __open_file(self, file_id):
+        # Returns the file's name and a GridOut with its contents, following
+        # links to deduplicated contents.
+        grid_out = self._gfs.get(file_id)
+        metadata = grid_out.metadata or {}
+        if self._config["FILES_CONTENT_ATTR"] in metadata:
+            return grid_out.filename, self._gfs.get(
+                metadata[self._config["FILES_CONTENT_ATTR"]]
+            )
+        return grid_out.filename, grid_out
+
+    def __download_file(self, grid_out, path):
+        metadata = grid_out.metadata or {}
+        with open(path, "wb") as f:
+            if self._config["FILES_CODEC_ATTR"] in metadata:
+                _, decompress = _codec(metadata[self._config["FILES_CODEC_ATTR"]])
+                stored = 0
+                for _, end in metadata[self._config["FILES_FRAMES_ATTR"]]:
+                    f.write(decompress(grid_out.read(end - stored)))
+                    stored = end
+                return
+            chunk = grid_out.readchunk()
+            while len(chunk) > 0:
+                f.write(chunk)
+                chunk = grid_out.readchunk()
+
+    def __delete_contents(self, content_id):
+        self._gfs.delete(content_id)
+        self._fastq_indexes.delete_one({"_id": content_id})
+
+    def _file_contents(self, file_id):
+        # Returns the fs.files document holding the file's contents, following
+        # links to deduplicated contents.
+        doc = self._db.fs.files.find_one({"_id": file_id})
+        if doc is None:
+            raise Exception("File not found.")
+        content_id = doc.get("metadata", {}).get(self._config["FILES_CONTENT_ATTR"])
+        if content_id is not None:
+            doc = self._db.fs.files.find_one({"_id": content_id})
+            if doc is None:
+                raise Exception("File contents not found.")
+        return doc
+
+    def _content_length(self, doc):
+        # Uncompressed length of the contents in a fs.files document.
+        return (doc.get("metadata") or {}).get(
+            self._config["FILES_SIZE_ATTR"], doc["length"]
+        )
+
+    def _read_contents(self, doc, offset, length):
+        end = min(self._content_length(doc), offset + length)
+        if offset >= end:
+            return b""
+        metadata = doc.get("metadata") or {}
+        if self._config["FILES_CODEC_ATTR"] not in metadata:
+            return self._read_chunks(doc, offset, end)
+
+        # Fetch and decompress only the frames covering the range.
+        _, decompress = _codec(metadata[self._config["FILES_CODEC_ATTR"]])
+        frames = metadata[self._config["FILES_FRAMES_ATTR"]]
+        first = bisect.bisect_right(frames, [offset, float("inf")])
+        last = bisect.bisect_right(frames, [end - 1, float("inf")])
+        raw_start, stored_start = frames[first - 1] if first > 0 else (0, 0)
+        data = self._read_chunks(doc, stored_start, frames[last][1])
+        raw = b"".join(
+            decompress(data[start - stored_start : stop - stored_start])
+            for start, stop in zip(
+                [stored_start] + [f[1] for f in frames[first:last]],
+                [f[1] for f in frames[first : last + 1]],
+            )
+        )
+        return raw[offset - raw_start : end - raw_start]
+
+    def _read_chunks(self, doc, offset, end):
+        # Reads the stored bytes in [offset, end) from the GridFS chunks.
+        if offset >= end:
+            return b""
+        size = doc["chunkSize"]
+        first, last = offset // size, (end - 1) // size
+        chunks = self._db.fs.chunks.find(
+            {"files_id": doc["_id"], "n": {"$gte": first, "$lte": last}},
+            {"data": 1},
+            sort=[("n", ASCENDING)],
+        )
+        data = b"".join(chunk["data"] for chunk in chunks)
+        start = offset - first * size
+        return data[start : start + end - offset]
+
+    def __next_individual_id(self):
+        doc = self._counters.find_one_and_update(
+            {"_id": self._config["INDIVIDUALS_COLL"]},
+            {"$inc": {self._config["COUNTERS_SEQ_VALUE_ATTR"]: 1}},
+        )
+        return doc[self._config["COUNTERS_SEQ_VALUE_ATTR"]]
+
+
+def default_db():
+    """Return the SnpDB instance used by the module-level functions.
+
+    It is created, with the default configuration file, on first use.
+    """
+    global _default
+    if _default is None:
+        with _DEFAULT_LOCK:
+            if _default is None:
+                _default = SnpDB()
+    return _default
+
+
+def connect(config_path="config.js", **options):
+    """Make the module-level functions use the database of a configuration.
+
+    A new default instance (see default_db) is created and connected right
+    away. Calling this is only needed to use another configuration file, to
+    connect eagerly, or to start over with fresh handles after the database
+    was recreated. Returns the new instance.
+
+    Parameters
+    ----------
+    config_path="config.js"     Path to the configuration file.
+    **options                   Other options of the new instance (see
+                                SnpDB), e.g. map_cache_ttl.
+    """
+    global _default
+    db = SnpDB(config_path, **options)
+    db.connect()
+    with _DEFAULT_LOCK:
+        previous, _default = _default, db
+    if previous is not None:
+        previous.close()
+    return db
+
+
+def __getattr__(name):
+    # Handles of the default instance under their former module-level names
+    # (snpdb._db, snpdb._config, snpdb._SNPS...), used by experiment scripts.
+    if name.lower() in _HANDLES:
+        return getattr(default_db(), name.lower())
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def _default_method(name):
+    method = getattr(SnpDB, name)
+
+    @functools.wraps(method)
+    def call(*args, **kwargs):
+        return getattr(default_db(), name)(*args, **kwargs)
+
+    return call
+
+
+# Module-level functions, calling the methods of the default instance.
+for _name in [name for name in vars(SnpDB) if name[0] != "_" and name != "connect"]:
+    globals()[_name] = _default_method(_name)
+
+_default = None
+_DEFAULT_LOCK = threading.Lock()
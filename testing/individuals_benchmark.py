@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+"""Benchmark queries on individuals linked to many samples.
+
+Inserts synthetic individuals directly into the individuals collection
+(no blocks or samples are created), then times find_individuals with and
+without projection and delete_individuals over them. Run it from the
+repository root against a scratch database, e.g.:
+
+    python -m testing.individuals_benchmark -n 1000 -s 500
+"""
+
+import argparse
+import snpdb
+import time
+
+
+def _stopwatch(f, *args, **kwargs):
+    start = time.time()
+    f(*args, **kwargs)
+    return time.time() - start
+
+
+def create_individuals(n, samples_per_individual, map_name="BENCH"):
+    inds = [
+        {
+            "_id": f"BENCH{i + 1}",
+            snpdb._config["INDIVIDUALS_ID_LIST_ATTR"]: [f"T{i + 1}"],
+            snpdb._config["INDIVIDUALS_SAMPLE_LIST_ATTR"]: [
+                {
+                    snpdb._config["SAMPLES_MAP_ATTR"]: map_name,
+                    snpdb._config["SAMPLES_ID_ATTR"]: f"S{i + 1}_{j + 1}",
+                }
+                for j in range(samples_per_individual)
+            ],
+        }
+        for i in range(n)
+    ]
+    snpdb._INDS.insert_many(inds)
+
+
+def run(n=1000, samples_per_individual=500, map_name="BENCH"):
+    create_individuals(n, samples_per_individual, map_name)
+    tatoos = snpdb._config["INDIVIDUALS_ID_LIST_ATTR"]
+    t_full = _stopwatch(snpdb.find_individuals, sample_map=map_name)
+    t_ids = _stopwatch(snpdb.find_individuals, sample_map=map_name, projection=["_id"])
+    t_tatoos = _stopwatch(
+        snpdb.find_individuals, sample_map=map_name, projection=[tatoos]
+    )
+    t_delete = _stopwatch(snpdb.delete_individuals, sample_map=map_name)
+    print(
+        f"{n} individuals x {samples_per_individual} samples: "
+        + f"find (full): {t_full:.3f} s, find (_id): {t_ids:.3f} s, "
+        + f"find ({tatoos}): {t_tatoos:.3f} s, delete: {t_delete:.3f} s"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", help="number of individuals", type=int, default=1000)
+    parser.add_argument(
+        "-s", help="number of samples per individual", type=int, default=500
+    )
+    parser.add_argument("--map", help="map name used for the samples", default="BENCH")
+    args = parser.parse_args()
+    run(args.n, args.s, args.map)
@@ -0,0 +1,32 @@
+#!/bin/bash
+# Starts or stops a local sharded cluster for testing: a config server, two
+# shards (each a single-node replica set) and a mongos on port 27017, each
+# one a separate process with its data and log under DIR. After starting it,
+# the database can be set up with: mongo mongo_shard_setup.js
+if [ "$1" == "start" ] && [ -n "$2" ]; then
+    mkdir -p "$2/config" "$2/shard1" "$2/shard2"
+    mongod --configsvr --replSet config --port 27019 --dbpath "$2/config" \
+        --fork --logpath "$2/config.log" &&
+        mongo --port 27019 --quiet --eval "rs.initiate()" &&
+        for i in 1 2; do
+            mongod --shardsvr --replSet "shard$i" --port $((27019 + i)) \
+                --dbpath "$2/shard$i" --fork --logpath "$2/shard$i.log" &&
+                mongo --port $((27019 + i)) --quiet --eval "rs.initiate()" ||
+                exit 1
+        done &&
+        sleep 5 &&
+        mongos --configdb config/localhost:27019 --port 27017 \
+            --fork --logpath "$2/mongos.log" &&
+        mongo --quiet --eval "sh.addShard('shard1/localhost:27020'); sh.addShard('shard2/localhost:27021')" &&
+        exit 0
+    exit 1
+elif [ "$1" == "stop" ]; then
+    for port in 27017 27020 27021 27019; do
+        mongo --port $port --quiet --eval "db.adminCommand({shutdown: 1})" ||
+            echo "Warning: nothing running on port $port"
+    done
+    exit 0
+else
+    echo "usage: local_cluster.sh {start DIR|stop}"
+    exit 1
+fi
@@ -1,9 +1,9 @@
 import cli
+import contextlib
 import os
 import time
 import snpdb
 import random
-import importlib
 
 
 def _stopwatch(f, *args, **kwargs):
@@ -30,7 +30,19 @@ _PED_EXTS = {".0125ped", ".plped", ".vcf", ".fr"}
 _IDS_EXTS = {".ids"}
 
 
-def mass_import(directory, maps_only=False, clear_before_each=False, **kwargs):
+def _import_session(defer_indexes):
+    if not defer_indexes:
+        return contextlib.nullcontext()
+    return snpdb.import_session(report=True)
+
+
+def mass_import(
+    directory,
+    maps_only=False,
+    clear_before_each=False,
+    defer_indexes=False,
+    **kwargs,
+):
     exts = {}
     for root, subdirs, files in os.walk(directory):
         for filename in files:
@@ -40,71 +52,74 @@ def mass_import(directory, maps_only=False, clear_before_each=False, **kwargs):
                 exts[name] = {ext}
             else:
                 exts[name].add(ext)
-    for name in exts:
-        imap = exts[name].intersection(_MAP_EXTS)
-        iped = exts[name].intersection(_PED_EXTS)
-        iids = exts[name].intersection(_IDS_EXTS)
-
-        if len(imap) > 1:
-            raise Exception("Multiple map files with the same name.")
-        if len(iped) > 1:
-            raise Exception("Multiple ped files with the same name.")
-        if len(iids) > 1:
-            raise Exception("Multiple id files with the same name.")
-
-        mapfileext, pedfileext, idsfileext = None, None, None
-        if len(imap) == 1:
-            mapfileext = imap.pop()
-        if len(iped) == 1:
-            pedfileext = iped.pop()
-        if len(iids) == 1:
-            idsfileext = iids.pop()
-
-        if mapfileext is None:
-            mapfileext = pedfileext
-
-        if (
-            mapfileext is not None
-            and pedfileext is not None
-            and _EXT_FORMAT[mapfileext] != _EXT_FORMAT[pedfileext]
-        ):
-            raise Exception("Incompatible map and ped files.")
-
-        fmt = _EXT_FORMAT[mapfileext]
-
-        print("-" * 100)
-        if clear_before_each:
-            _reset_db()
-            importlib.reload(snpdb)
-            importlib.reload(cli)
-
-        t_m = _stopwatch(
-            cli.import_map, name + mapfileext, fmt, name, report=True, **kwargs
-        )
-
-        if not maps_only and pedfileext is not None:
-            idfilename = None
-            if idsfileext is not None:
-                idfilename = name + idsfileext
-            t_p = _stopwatch(
-                cli.import_samples,
-                name + pedfileext,
-                fmt,
-                name,
-                idfilename=idfilename,
-                report=True,
+    # With clear_before_each, every file goes to a fresh database, so each
+    # gets its own import session. Otherwise, indexes are rebuilt once.
+    with _import_session(defer_indexes and not clear_before_each):
+        for name in exts:
+            imap = exts[name].intersection(_MAP_EXTS)
+            iped = exts[name].intersection(_PED_EXTS)
+            iids = exts[name].intersection(_IDS_EXTS)
+
+            if len(imap) > 1:
+                raise Exception("Multiple map files with the same name.")
+            if len(iped) > 1:
+                raise Exception("Multiple ped files with the same name.")
+            if len(iids) > 1:
+                raise Exception("Multiple id files with the same name.")
+
+            mapfileext, pedfileext, idsfileext = None, None, None
+            if len(imap) == 1:
+                mapfileext = imap.pop()
+            if len(iped) == 1:
+                pedfileext = iped.pop()
+            if len(iids) == 1:
+                idsfileext = iids.pop()
+
+            if mapfileext is None:
+                mapfileext = pedfileext
+
+            if (
+                mapfileext is not None
+                and pedfileext is not None
+                and _EXT_FORMAT[mapfileext] != _EXT_FORMAT[pedfileext]
+            ):
+                raise Exception("Incompatible map and ped files.")
+
+            fmt = _EXT_FORMAT[mapfileext]
+
+            print("-" * 100)
+            if clear_before_each:
+                _reset_db()
+                snpdb.connect()
+
+            with _import_session(defer_indexes and clear_before_each):
+                t_m = _stopwatch(
+                    cli.import_map, name + mapfileext, fmt, name, report=True, **kwargs
+                )
+
+                if not maps_only and pedfileext is not None:
+                    idfilename = None
+                    if idsfileext is not None:
+                        idfilename = name + idsfileext
+                    t_p = _stopwatch(
+                        cli.import_samples,
+                        name + pedfileext,
+                        fmt,
+                        name,
+                        idfilename=idfilename,
+                        report=True,
+                    )
+                else:
+                    t_p = 0.0
+
+            stats = snpdb.get_db_stats(2 ** 20)
+            data = stats["dataSize"]
+            storage = stats["storageSize"]
+            print(
+                f"{name}: "
+                + f"map: {t_m:.3f} s, ped: {t_p:.3f} s, "
+                + f"db size (raw): {data:.1f} MiB, compressed: {storage:.1f} MiB"
             )
-        else:
-            t_p = 0.0
-
-        stats = snpdb.get_db_stats(2 ** 20)
-        data = stats["dataSize"]
-        storage = stats["storageSize"]
-        print(
-            f"{name}: "
-            + f"map: {t_m:.3f} s, ped: {t_p:.3f} s, "
-            + f"db size (raw): {data:.1f} MiB, compressed: {storage:.1f} MiB"
-        )
 
 
 def create_individuals(n):